@@ -0,0 +1,328 @@
+#!/usr/bin/python
+
+"""
+Times discovery and the session layer against the simulated backend, writing
+the results as JSON so runs can be compared for regressions.
+
+	python benchmark.py --sizes 10,100,1000,10000 --output before.json
+
+All timings are in seconds, each the min and median of --repeat runs.
+Scans are measured through the pool, the main loop and the addressbook, up
+to the contact lists hearing about the devices.  MembersChanged is measured
+up to the membership views signalling the channels, the D-Bus marshalling
+itself needs a bus and is left out.
+"""
+
+from __future__ import with_statement
+
+import sys
+sys.path.insert(0,"../src")
+import gc
+import time
+import random
+import weakref
+import logging
+import itertools
+import optparse
+
+try:
+	import json
+except ImportError:
+	import simplejson as json
+
+import gobject
+
+try:
+	import tp
+	import handle
+	import channel.contact_list as contact_list
+except ImportError:
+	# Only the handle and MembersChanged benchmarks need the telepathy stack
+	# (and so D-Bus), the rest still run without it
+	tp = None
+
+import protocol.simulated_backend as simulated_backend
+import protocol.addressbook as addressbook
+import protocol.device_cache as device_cache
+import util.go_utils as gobject_utils
+
+
+_DEFAULT_SIZES = (10, 100, 1000, 10000)
+# Fraction of devices added, removed and changed between scans for the churn
+# measurements
+_CHURN = 0.01
+
+
+class _IdleNameResolver(object):
+	"""
+	Stands in for the name resolver so queueing name lookups isn't counted as
+	part of the diff
+	"""
+
+	def connect(self, signal, callback):
+		pass
+
+	def request(self, address):
+		pass
+
+
+class _BenchSession(object):
+
+	def __init__(self, addressbook):
+		self.addressbook = addressbook
+
+
+class _BenchConnection(object):
+	"""
+	Just the handle bookkeeping of tp.Connection, borrowed from it so handles
+	can be created without a bus to register the connection on
+	"""
+
+	_usernames = itertools.count()
+
+	if tp is not None:
+		get_handle_id = tp.Connection.get_handle_id.im_func
+		add_handle = tp.Connection.add_handle.im_func
+
+	def __init__(self, session = None):
+		# Unique so the handle factory's cache never hands out another
+		# connection's handles
+		self.username = "benchmark%d" % self._usernames.next()
+		self.session = session
+		self._handles = weakref.WeakValueDictionary()
+		self._handles_by_name = weakref.WeakValueDictionary()
+		self._next_handle_id = 1
+
+
+def _summarize(samples):
+	samples = sorted(samples)
+	return {
+		"min": samples[0],
+		"median": samples[len(samples) // 2],
+	}
+
+
+def _time(func, *args):
+	gc.collect()
+	start = time.time()
+	func(*args)
+	return time.time() - start
+
+
+def _create_backend(size, inquiryLatency):
+	return simulated_backend.SimulatedBackend(
+		deviceCount = size,
+		inquiryLatency = inquiryLatency,
+		nameDelay = 0,
+		sdpDelay = 0,
+		connectDelay = 0,
+	)
+
+
+def _create_addressbook(backend, asyncPool = None):
+	if asyncPool is None:
+		asyncPool = gobject_utils.AsyncPool()
+	cache = device_cache.DeviceCache(None)
+	return addressbook.Addressbook(backend, asyncPool, _IdleNameResolver(), cache)
+
+
+def _run_update(book, contacts):
+	# Drive the update by hand rather than through the pool and main loop so
+	# only the diff is measured
+	update = book._update(False, None)
+	update.next()
+	try:
+		update.send(contacts)
+	except StopIteration:
+		pass
+
+
+def _churn(contacts, count, rand):
+	"""
+	@returns contacts with count devices removed, count changed and count
+		new ones added
+	"""
+	contacts = list(contacts)
+	rand.shuffle(contacts)
+	kept = contacts[count:]
+	changed = [
+		(address, deviceclass ^ 0x100, name)
+		for (address, deviceclass, name) in kept[:count]
+	]
+	added = [
+		("01:00:00:%02X:%02X:%02X" % ((index >> 16) & 0xFF, (index >> 8) & 0xFF, index & 0xFF), 0x5a020c, None)
+		for index in xrange(count)
+	]
+	return changed + kept[count:] + added
+
+
+def bench_scan(size, inquiryLatency):
+	backend = _create_backend(size, inquiryLatency)
+	asyncPool = gobject_utils.AsyncPool()
+	book = _create_addressbook(backend, asyncPool)
+	loop = gobject.MainLoop()
+	firstContact = []
+	finished = []
+	errors = []
+
+	def on_contacts_changed(book, added, removed, changed):
+		if added and not firstContact:
+			firstContact.append(time.time())
+
+	def on_success(stats):
+		finished.append(time.time())
+		loop.quit()
+
+	def on_error(error):
+		errors.append(error)
+		loop.quit()
+
+	book.connect("contacts_changed", on_contacts_changed)
+	asyncPool.start()
+	try:
+		start = time.time()
+		book.update(force = True, streaming = True, on_success = on_success, on_error = on_error)
+		loop.run()
+	finally:
+		asyncPool.stop()
+	if errors:
+		raise errors[0]
+	return {
+		"time_to_first_contact": firstContact[0] - start,
+		"full_scan": finished[0] - start,
+	}
+
+
+def bench_diff(size, rand):
+	backend = _create_backend(size, 0)
+	contacts = backend.get_contacts()
+	churned = _churn(contacts, max(1, int(size * _CHURN)), rand)
+
+	book = _create_addressbook(backend)
+	return {
+		"diff_initial": _time(_run_update, book, contacts),
+		"diff_unchanged": _time(_run_update, book, contacts),
+		"diff_churn": _time(_run_update, book, churned),
+	}
+
+
+def bench_handles(size):
+	connection = _BenchConnection()
+	addresses = [device.address for device in simulated_backend.create_devices(size)]
+	handles = []
+
+	def create():
+		handles.extend(
+			handle.create_handle(connection, "contact", address)
+			for address in addresses
+		)
+
+	def lookup():
+		for address in addresses:
+			handle.create_handle(connection, "contact", address)
+
+	return {
+		"handle_create": _time(create),
+		"handle_lookup": _time(lookup),
+	}
+
+
+def bench_members_changed(size, rand):
+	backend = _create_backend(size, 0)
+	contacts = backend.get_contacts()
+	churned = _churn(contacts, max(1, int(size * _CHURN)), rand)
+
+	book = _create_addressbook(backend)
+	connection = _BenchConnection(_BenchSession(book))
+	membership = contact_list.ContactListMembership(connection)
+	for isOnList in (None, contact_list._is_blocked):
+		# Stands in for the channel, so the signal emission is paid for
+		view = membership.get_view(isOnList)
+		view.connect("members_changed", lambda view, added, removed: None)
+
+	try:
+		_run_update(book, contacts)
+		initial = _time(membership._flush)
+		_run_update(book, churned)
+		churn = _time(membership._flush)
+	finally:
+		membership.close()
+	return {
+		"members_changed_initial": initial,
+		"members_changed_churn": churn,
+	}
+
+
+def run(sizes, repeat, inquiryLatency, seed):
+	results = {}
+	for size in sizes:
+		samples = {}
+		rand = random.Random(seed)
+		benchmarks = [
+			(bench_scan, (size, inquiryLatency)),
+			(bench_diff, (size, rand)),
+		]
+		if tp is not None:
+			benchmarks.extend((
+				(bench_handles, (size, )),
+				(bench_members_changed, (size, rand)),
+			))
+		for _ in xrange(repeat):
+			for func, args in benchmarks:
+				for name, value in func(*args).iteritems():
+					samples.setdefault(name, []).append(value)
+		results[str(size)] = dict(
+			(name, _summarize(values))
+			for (name, values) in samples.iteritems()
+		)
+		print >> sys.stderr, "Finished %d devices" % (size, )
+	return results
+
+
+def main(args):
+	gobject.threads_init()
+
+	parser = optparse.OptionParser()
+	parser.add_option(
+		"--sizes", default = ",".join(str(size) for size in _DEFAULT_SIZES),
+		help = "Comma separated device counts",
+	)
+	parser.add_option("--repeat", type = "int", default = 3)
+	parser.add_option(
+		"--inquiry-latency", type = "float", default = 0.5,
+		help = "Seconds the simulated inquiry takes to find every device",
+	)
+	parser.add_option("--seed", type = "int", default = 0)
+	parser.add_option("--output", default = None, help = "File to write, defaults to stdout")
+	options, _ = parser.parse_args(args)
+
+	logging.basicConfig(level=logging.WARNING)
+	sizes = [int(size) for size in options.sizes.split(",")]
+	skipped = []
+	if tp is None:
+		skipped = ["bench_handles", "bench_members_changed"]
+		print >> sys.stderr, "telepathy is not importable, skipping %s" % (", ".join(skipped), )
+	report = {
+		"python": sys.version.split()[0],
+		"timestamp": time.time(),
+		"skipped": skipped,
+		"parameters": {
+			"sizes": sizes,
+			"repeat": options.repeat,
+			"inquiryLatency": options.inquiry_latency,
+			"churn": _CHURN,
+			"seed": options.seed,
+		},
+		"results": run(sizes, options.repeat, options.inquiry_latency, options.seed),
+	}
+
+	if options.output is None:
+		json.dump(report, sys.stdout, indent = 2, sort_keys = True)
+		print
+	else:
+		with open(options.output, "w") as f:
+			json.dump(report, f, indent = 2, sort_keys = True)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
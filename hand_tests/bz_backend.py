@@ -5,11 +5,12 @@ sys.path.insert(0,"../src")
 import logging
 
 import protocol.backend as backend
+import protocol.bluez_backend as bluez_backend
 
 def main():
 	logging.basicConfig(level=logging.DEBUG)
 
-	bb = backend.BluetoothBackend()
+	bb = bluez_backend.BluetoothBackend()
 	bb.login()
 
 	contacts = bb.get_contacts()
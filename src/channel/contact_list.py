@@ -1,15 +1,172 @@
 import logging
 
+import gobject
 import telepathy
 
 import tp
 import util.misc as misc_utils
+import util.go_utils as gobject_utils
 import handle
 
 
 _moduleLogger = logging.getLogger(__name__)
 
 
+class ContactListMembership(object):
+	"""
+	The contacts known to the addressbook along with their handles, shared by
+	all of the contact list channels so each addressbook delta is reconciled
+	and turned into handles once no matter how many lists are open.  Lists
+	wanting a subset of the contacts get a filtered MembershipView.
+	"""
+
+	# Streaming discovery trickles in many small deltas, fold the ones that
+	# land this close together into one MembersChanged
+	_COALESCE_WINDOW_IN_MS = 200
+
+	def __init__(self, connection):
+		self._conn = connection
+		self._addressbook = connection.session.addressbook
+
+		# number -> handle
+		self._handles = {}
+		self._dirtyContacts = set()
+		self._flushTimeout = gobject_utils.Timeout(self._on_flush)
+		# isOnList -> MembershipView
+		self._views = {}
+
+		self._updateId = self._addressbook.connect("contacts_changed", self._on_contacts_refreshed)
+		self._dirtyContacts.update(self._addressbook.get_addresses())
+		self._flush()
+
+	def close(self):
+		if self._updateId is not None:
+			self._addressbook.disconnect(self._updateId)
+			self._updateId = None
+		self._flushTimeout.cancel()
+		self._dirtyContacts.clear()
+		self._views.clear()
+
+	def get_view(self, isOnList = None):
+		"""
+		@param isOnList Function taking a contact's number and returning
+			whether it belongs on the list, None for every contact
+		"""
+		try:
+			return self._views[isOnList]
+		except KeyError:
+			view = MembershipView(self, isOnList)
+			self._views[isOnList] = view
+			return view
+
+	def get_handles(self):
+		"""
+		@returns {number: handle} of every contact
+		"""
+		return self._handles
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_contacts_refreshed(self, addressbook, added, removed, changed):
+		self._dirtyContacts.update(added)
+		self._dirtyContacts.update(removed)
+		self._dirtyContacts.update(changed)
+		if self._dirtyContacts and not self._flushTimeout.is_running():
+			self._flushTimeout.start(milliseconds=self._COALESCE_WINDOW_IN_MS)
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_flush(self):
+		self._flush()
+
+	def _flush(self):
+		"""
+		Reconcile the contacts touched since the last flush against the
+		addressbook, an add and remove of the same contact within the window
+		netting out to nothing
+		"""
+		dirtyContacts, self._dirtyContacts = self._dirtyContacts, set()
+		added = {}
+		removed = {}
+		changed = {}
+		for number in dirtyContacts:
+			isMember = number in self._handles
+			if self._addressbook.has_contact(number):
+				if isMember:
+					changed[number] = self._handles[number]
+				else:
+					h = handle.create_handle(self._conn, "contact", number)
+					self._handles[number] = h
+					added[number] = h
+			elif isMember:
+				removed[number] = self._handles.pop(number)
+		if not added and not removed and not changed:
+			return
+
+		for view in self._views.itervalues():
+			view.apply(added, removed, changed)
+
+
+class MembershipView(gobject.GObject):
+	"""
+	The subset of the shared membership a kind of list shows
+	"""
+
+	__gsignals__ = {
+		'members_changed' : (
+			gobject.SIGNAL_RUN_LAST,
+			gobject.TYPE_NONE,
+			(gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT),
+		),
+	}
+
+	def __init__(self, membership, isOnList):
+		gobject.GObject.__init__(self)
+		self._isOnList = isOnList
+		if isOnList is None:
+			self._handles = membership.get_handles()
+		else:
+			self._handles = dict(
+				(number, h)
+				for (number, h) in membership.get_handles().iteritems()
+				if isOnList(number)
+			)
+
+	def get_handles(self):
+		return self._handles.values()
+
+	def apply(self, added, removed, changed):
+		"""
+		@param added {number: handle}
+		@param removed {number: handle}
+		@param changed {number: handle}
+		"""
+		if self._isOnList is None:
+			# Shares its dict with the membership, already up to date
+			handlesAdded = added.values()
+			handlesRemoved = removed.values()
+		else:
+			handlesAdded = []
+			handlesRemoved = [
+				self._handles.pop(number)
+				for number in removed
+				if number in self._handles
+			]
+			for contacts in (added, changed):
+				for number, h in contacts.iteritems():
+					isMember = number in self._handles
+					if isMember != self._isOnList(number):
+						if isMember:
+							handlesRemoved.append(self._handles.pop(number))
+						else:
+							self._handles[number] = h
+							handlesAdded.append(h)
+
+		if handlesAdded or handlesRemoved:
+			self.emit("members_changed", handlesAdded, handlesRemoved)
+
+
+gobject.type_register(MembershipView)
+
+
 class AllContactsListChannel(
 		tp.ChannelTypeContactList,
 		tp.ChannelInterfaceGroup,
@@ -24,15 +181,11 @@ class AllContactsListChannel(
 
 		self.__manager = manager
 		self.__props = props
-		self.__session = connection.session
 		self.__listHandle = listHandle
-		self.__members = set()
 
-		self.__updateId = self.__session.addressbook.connect("contacts_changed", self._on_contacts_refreshed)
-
-		addressbook = connection.session.addressbook
-		contacts = addressbook.get_addresses()
-		self._process_refresh(addressbook, set(contacts), set(), set())
+		self.__view = manager.contactListMembership.get_view(self._get_list_filter())
+		self.__updateId = self.__view.connect("members_changed", self._on_members_changed)
+		self._process_refresh(self.__view.get_handles(), [])
 
 		self.GroupFlagsChanged(0, 0)
 
@@ -43,8 +196,9 @@ class AllContactsListChannel(
 
 	def close(self):
 		_moduleLogger.debug("Closing contact list")
-		self.__session.addressbook.updateSignalHandler.disconnect(self.__updateId)
-		self.__updateId = None
+		if self.__updateId is not None:
+			self.__view.disconnect(self.__updateId)
+			self.__updateId = None
 
 		tp.ChannelTypeContactList.Close(self)
 		self.remove_from_connection()
@@ -53,62 +207,24 @@ class AllContactsListChannel(
 	def GetLocalPendingMembersWithInfo(self):
 		return []
 
-	@misc_utils.log_exception(_moduleLogger)
-	def _on_contacts_refreshed(self, addressbook, added, removed, changed):
-		self._process_refresh(addressbook, added, removed, changed)
-
-	def _is_on_list(self, number):
-		return True
-
-	def _is_on_list_changed(self, number):
-		return (number in self.__members) ^ (self._is_on_list(number))
-
-	def _is_now_on_list(self, number):
-		return number not in self.__members and self._is_on_list(number)
+	def _get_list_filter(self):
+		"""
+		@returns Function deciding if a contact belongs on this list, None for
+			all contacts.  Lists using the same function share their view.
+		"""
+		return None
 
-	def _was_on_list(self, number):
-		return number in self.__members and not self._is_on_list(number)
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_members_changed(self, view, handlesAdded, handlesRemoved):
+		self._process_refresh(handlesAdded, handlesRemoved)
 
-	def _process_refresh(self, addressbook, added, removed, changed):
+	def _process_refresh(self, handlesAdded, handlesRemoved):
+		if not handlesAdded and not handlesRemoved:
+			return
 		_moduleLogger.info(
-			"%s Added: %r, Removed: %r" % (self.__listHandle.get_name(), len(added), len(removed))
-		)
-		connection = self._conn
-
-		# convert changed into added/removed
-		alsoAdded = set(
-			number
-			for number in changed
-			if self._is_now_on_list(number)
-		)
-		alsoRemoved = set(
-			number
-			for number in changed
-			if self._was_on_list(number)
+			"%s Added: %r, Removed: %r" % (self.__listHandle.get_name(), len(handlesAdded), len(handlesRemoved))
 		)
 
-		# Merge the added/removed with changed
-		added = [
-			contactNumber
-			for contactNumber in added
-			if self._is_on_list(contactNumber)
-		]
-		added.extend(alsoAdded)
-		added.sort()
-		handlesAdded = [
-			handle.create_handle(connection, "contact", contactNumber)
-			for contactNumber in added
-		]
-		self.__members.union(added)
-
-		removed = list(removed)
-		removed.extend(alsoRemoved)
-		handlesRemoved = [
-			handle.create_handle(connection, "contact", contactNumber)
-			for contactNumber in removed
-		]
-		self.__members.difference(removed)
-
 		message = ""
 		actor = 0
 		reason = telepathy.CHANNEL_GROUP_CHANGE_REASON_NONE
@@ -121,10 +237,15 @@ class AllContactsListChannel(
 		)
 
 
+def _is_blocked(number):
+	# Nothing blocks a device from pushing to us over bluetooth
+	return False
+
+
 class DenyContactsListChannel(AllContactsListChannel):
 
-	def _is_on_list(self, number):
-		return self._conn.session.addressbook.is_blocked(number)
+	def _get_list_filter(self):
+		return _is_blocked
 
 
 _LIST_TO_FACTORY = {
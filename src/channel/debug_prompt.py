@@ -129,6 +129,57 @@ class DebugPromptChannel(tp.ChannelTypeText, cmd.Cmd):
 	def help_get_state_status(self):
 		self._report_new_message("Prints the current setting for the state machines")
 
+	def do_get_service_cache_stats(self, args):
+		if args:
+			self._report_new_message("No arguments supported")
+			return
+
+		try:
+			stats = self._conn.session.backend.serviceCache.get_stats()
+			self._report_new_message("\n".join(
+				"%s: %s" % (name, value)
+				for (name, value) in sorted(stats.iteritems())
+			))
+		except Exception, e:
+			self._report_new_message(str(e))
+
+	def help_get_service_cache_stats(self):
+		self._report_new_message("Prints the hit/miss counts for the SDP record cache")
+
+	def do_get_inquiry_stats(self, args):
+		if args:
+			self._report_new_message("No arguments supported")
+			return
+
+		try:
+			stats = self._conn.session.backend.get_inquiry_stats()
+			self._report_new_message("\n".join(
+				"%s: %s" % (name, value)
+				for (name, value) in sorted(stats.iteritems())
+			))
+		except Exception, e:
+			self._report_new_message(str(e))
+
+	def help_get_inquiry_stats(self):
+		self._report_new_message("Prints how many inquiries and name lookups ran, how many overran and were abandoned and how many lookups were skipped while one was stuck")
+
+	def do_get_handle_stats(self, args):
+		if args:
+			self._report_new_message("No arguments supported")
+			return
+
+		try:
+			stats = self._conn.get_handle_stats()
+			self._report_new_message("\n".join(
+				"%s: %s" % (name, value)
+				for (name, value) in sorted(stats.iteritems())
+			))
+		except Exception, e:
+			self._report_new_message(str(e))
+
+	def help_get_handle_stats(self):
+		self._report_new_message("Prints how many handles are live, held by clients and have ever been allocated")
+
 	def help_version(self):
 		self._report_new_message("Prints the version (hint: %s-%s)" % (constants.__version__, constants.__build__))
 
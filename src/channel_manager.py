@@ -59,6 +59,23 @@ class ChannelManager(tp.ChannelManager):
 			[telepathy.CHANNEL_INTERFACE + '.TargetHandle']
 		)
 
+		self._contactListMembership = None
+
+	def close(self):
+		tp.ChannelManager.close(self)
+		if self._contactListMembership is not None:
+			self._contactListMembership.close()
+			self._contactListMembership = None
+
+	@property
+	def contactListMembership(self):
+		"""
+		Shared by all of the contact list channels
+		"""
+		if self._contactListMembership is None:
+			self._contactListMembership = channel.contact_list.ContactListMembership(self._conn)
+		return self._contactListMembership
+
 	def _get_list_channel(self, props):
 		_, surpress_handler, h = self._get_type_requested_handle(props)
 
@@ -1,3 +1,4 @@
+import os
 import weakref
 import logging
 
@@ -31,11 +32,17 @@ class BluewireOptions(object):
 
 	assert protocol.session.Session._DEFAULTS["contacts"][1] == "hours"
 	contactsPollPeriodInHours = protocol.session.Session._DEFAULTS["contacts"][0]
+	backend = "bluez"
 
 	def __init__(self, parameters = None):
 		if parameters is None:
 			return
 		self.contactsPollPeriodInHours = parameters['contacts-poll-period-in-hours']
+		self.backend = str(parameters['backend'])
+		try:
+			protocol.session.parse_backend_spec(self.backend)
+		except ValueError, e:
+			raise telepathy.errors.InvalidArgument("Invalid backend parameter: %s" % (e, ))
 
 
 class BluewireConnection(
@@ -55,9 +62,12 @@ class BluewireConnection(
 	# overiding base class variable
 	_optional_parameters = {
 		'contacts-poll-period-in-hours': 'i',
+		# "bluez" or "simulated[:option=value,...]" for testing without radios
+		'backend': 's',
 	}
 	_parameter_defaults = {
 		'contacts-poll-period-in-hours': BluewireOptions.contactsPollPeriodInHours,
+		'backend': BluewireOptions.backend,
 	}
 	_secret_parameters = set((
 	))
@@ -72,6 +82,8 @@ class BluewireConnection(
 			defaults = {
 				"contacts": (self.__options.contactsPollPeriodInHours, "hours"),
 			},
+			cachePath = os.path.join(constants._data_path_, "devices.cache"),
+			backendSpec = self.__options.backend,
 		)
 		tp.Connection.__init__(
 			self,
@@ -117,6 +129,10 @@ class BluewireConnection(
 
 	def get_handle_by_name(self, handleType, handleName):
 		requestedHandleName = handleName.encode('utf-8')
+		h = self._handles_by_name.get((handleType, requestedHandleName), None)
+		if h is not None:
+			return h
+
 		if handleType == telepathy.HANDLE_TYPE_CONTACT:
 			h = handle.create_handle(self, 'contact', requestedHandleName)
 		elif handleType == telepathy.HANDLE_TYPE_LIST:
@@ -11,13 +11,23 @@ _moduleLogger = logging.getLogger(__name__)
 
 class BluewireHandle(tp.Handle):
 	"""
-	Instances are memoized
+	Instances are memoized, slotted and write-once as there can be one per
+	device ever seen
 	"""
 
+	__slots__ = ('_conn', )
+
 	def __init__(self, connection, id, handleType, name):
 		tp.Handle.__init__(self, id, handleType, name)
 		self._conn = weakref.proxy(connection)
 
+	def __setattr__(self, name, value):
+		# Unset slots aren't found by hasattr, so this only lets through the
+		# initial assignments
+		if hasattr(self, name):
+			raise AttributeError("%s is immutable" % type(self).__name__)
+		tp.Handle.__setattr__(self, name, value)
+
 	def __repr__(self):
 		return "<%s id=%u name='%s'>" % (
 			type(self).__name__, self.id, self.name
@@ -30,6 +40,8 @@ class BluewireHandle(tp.Handle):
 
 class ConnectionHandle(BluewireHandle):
 
+	__slots__ = ('profile', )
+
 	def __init__(self, connection, id):
 		handleType = telepathy.HANDLE_TYPE_CONTACT
 		handleName = connection.username
@@ -40,6 +52,8 @@ class ConnectionHandle(BluewireHandle):
 
 class ContactHandle(BluewireHandle):
 
+	__slots__ = ('_address', )
+
 	def __init__(self, connection, id, address):
 		self._address = address
 
@@ -54,6 +68,8 @@ class ContactHandle(BluewireHandle):
 
 class ListHandle(BluewireHandle):
 
+	__slots__ = ()
+
 	def __init__(self, connection, id, listName):
 		handleType = telepathy.HANDLE_TYPE_LIST
 		handleName = listName
@@ -82,7 +98,7 @@ def create_handle_factory():
 			handle = Handle(connection, connection.get_handle_id(), *args)
 			cache[key] = handle
 			isNewHandle = True
-		connection._handles[handle.get_type(), handle.get_id()] = handle
+		connection.add_handle(handle)
 		if isNewHandle:
 			handleStatus = "Is New!" if isNewHandle else "From Cache"
 			_moduleLogger.debug("Created Handle: %r (%s)" % (handle, handleStatus))
@@ -1,3 +1,4 @@
+import itertools
 import logging
 
 import tp
@@ -13,6 +14,7 @@ class PresenceMixin(tp.ConnectionInterfacePresence, simple_presence.BluewirePres
 	def __init__(self):
 		tp.ConnectionInterfacePresence.__init__(self)
 		simple_presence.BluewirePresence.__init__(self)
+		self.session.addressbook.connect("contacts_changed", self.__on_contacts_changed)
 
 	@misc_utils.log_exception(_moduleLogger)
 	def GetStatuses(self):
@@ -40,9 +42,18 @@ class PresenceMixin(tp.ConnectionInterfacePresence, simple_presence.BluewirePres
 		assert len(arguments) == 0
 		self.set_presence(status)
 
+	@misc_utils.log_exception(_moduleLogger)
+	def __on_contacts_changed(self, addressbook, added, removed, changed):
+		presences = self.get_contact_presences(itertools.chain(added, removed, changed))
+		if presences:
+			self.PresenceUpdate(self.__to_presences(presences))
+
 	def __get_presences(self, contacts):
+		return self.__to_presences(self.get_presences(contacts))
+
+	def __to_presences(self, presences):
 		arguments = {}
 		return dict(
 			(h, (0, {presence: arguments}))
-			for (h, (presenceType, presence)) in self.get_presences(contacts).iteritems()
+			for (h, (presenceType, presence)) in presences.iteritems()
 		)
@@ -1,5 +1,15 @@
 #!/usr/bin/python
 
+import records
+import eir
+import proximity
+import device_table
+import framing
 import backend
+import simulated_backend
 import addressbook
+import name_resolver
+import probe_scheduler
+import device_cache
+import service_cache
 import session
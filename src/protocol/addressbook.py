@@ -1,6 +1,8 @@
 #!/usr/bin/python
 
 
+import time
+import Queue
 import logging
 
 import gobject
@@ -8,6 +10,10 @@ import gobject
 import util.misc as misc_utils
 import util.go_utils as gobject_utils
 
+import records
+import proximity
+import device_table
+
 
 _moduleLogger = logging.getLogger(__name__)
 
@@ -20,61 +26,337 @@ class Addressbook(gobject.GObject):
 			gobject.TYPE_NONE,
 			(gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT),
 		),
+		'update_complete' : (
+			gobject.SIGNAL_RUN_LAST,
+			gobject.TYPE_NONE,
+			(gobject.TYPE_PYOBJECT, ),
+		),
 	}
 
-	def __init__(self, backend, asyncPool):
+	def __init__(self, backend, asyncPool, nameResolver, deviceCache, absenceThreshold = 1, prober = None):
+		"""
+		@param absenceThreshold How many updates in a row a device has to be
+			missing from before it is removed, so flaky devices don't thrash
+		@param prober ProbeScheduler to keep known devices' presence fresh
+			between updates with
+		"""
 		gobject.GObject.__init__(self)
 		self._backend = backend
-		self._addresses = {}
+		self._devices = device_table.DeviceTable(absenceThreshold)
 		self._asyncPool = asyncPool
+		self._nameResolver = nameResolver
+		self._cache = deviceCache
+		self._prober = prober
+		self._updateExecution = None
+		# (on_success, on_error) of everyone waiting on the in-flight update
+		self._updateWaiters = []
+		self._lastUpdateTime = None
+		self._lastUpdateStats = None
+		# Known devices that didn't answer their last probe
+		self._unreachable = set()
+		# Known devices that answered their last probe since the last update,
+		# counted as seen by the next one however many scans removal takes
+		self._answeredProbes = set()
+		# address -> proximity band as of the last update
+		self._bands = {}
+		# Changes streamed in since the last update completed
+		self._streamedChangeCount = 0
 
-	def update(self, force=False):
-		if not force and self._addresses:
-			return
+		self._backend.connect("contact_discovered", self._on_contact_discovered)
+		self._nameResolver.connect("name_resolved", self._on_name_resolved)
+		if self._prober is not None:
+			self._prober.connect("probed", self._on_probed)
 
-		le = gobject_utils.AsyncLinearExecution(self._asyncPool, self._update)
-		le.start()
+	def load_cache(self):
+		"""
+		Seed the addressbook with the devices seen in previous sessions, the
+		next update will weed out the ones that are no longer around
+		"""
+		self._cache.load()
+		addedContacts = set()
+		for address, deviceclass, name in self._cache.get_devices():
+			contact = self._populate_contact(address, deviceclass, name)
+			address = str(contact.address)
+			if address in self._devices:
+				continue
+			self._devices.observe(contact)
+			addedContacts.add(address)
 
-	@misc_utils.log_exception(_moduleLogger)
-	def _update(self):
-		contacts = yield (
-			self._backend.get_contacts,
-			(),
-			{},
+			services = self._cache.get_services(address)
+			if services:
+				self._backend.serviceCache.import_records(address, services)
+
+		self._track_contacts(addedContacts)
+		if addedContacts:
+			self.emit("contacts_changed", addedContacts, set(), set())
+
+	def save_cache(self):
+		serviceCache = self._backend.serviceCache
+		for address in self._devices.iterkeys():
+			self._cache.set_services(address, serviceCache.export_records(address))
+		self._cache.save()
+
+	def update(self, force=False, streaming=True, minFreshness=None, on_success=None, on_error=None):
+		"""
+		Updates are single-flight, requesting one while another is queued or
+		running joins it rather than starting a second inquiry
+
+		@param streaming Apply each device as the inquiry finds it, emitting
+			small "contacts_changed" diffs, with the final diff only carrying
+			what was left over (removals)
+		@param minFreshness Seconds, settle for the last update if it completed
+			within this long rather than inquiring again
+		@param on_success Called with the stats of the update satisfying the
+			request, as sent with "update_complete"
+		@param on_error Called with the error if that update failed or was
+			cancelled
+		@returns True if a new update was started
+		"""
+		if self._updateExecution is not None:
+			self._updateWaiters.append((on_success, on_error))
+			return False
+
+		isFresh = (
+			minFreshness is not None and
+			self._lastUpdateTime is not None and
+			time.time() - self._lastUpdateTime <= minFreshness
 		)
-		oldContacts = self._addresses
-		oldContactAddresses = set(self.get_addresses())
-
-		self._addresses = self._populate_contacts(contacts)
-		newContactAddresses = set(self.get_addresses())
-
-		addedContacts = newContactAddresses - oldContactAddresses
-		removedContacts = oldContactAddresses - newContactAddresses
-		changedContacts = set(
-			contactAddress
-			for contactAddress in newContactAddresses.intersection(oldContactAddresses)
-			if self._addresses[contactAddress] != oldContacts[contactAddress]
+		if isFresh or (not force and self._devices):
+			if on_success is not None:
+				gobject_utils.async(on_success)(self._lastUpdateStats)
+			return False
+
+		le = gobject_utils.AsyncLinearExecution(
+			self._asyncPool,
+			self._update,
+			priority = gobject_utils.AsyncPool.PRIORITY_BACKGROUND,
+			# Only one inquiry at a time, the radio can't do more
+			key = "inquiry",
 		)
+		self._updateExecution = le
+		self._updateWaiters.append((on_success, on_error))
+		try:
+			le.start(streaming, le.cancellation)
+		except Queue.Full, e:
+			# The inquiry never got queued, unwind _update the same as if it
+			# had failed so the prober resumes and the waiters hear about it
+			le.on_error(e)
+			return False
+		return True
+
+	def cancel(self):
+		"""
+		Abort any in-progress update, including the inquiry itself, failing
+		everyone waiting on it
+		"""
+		if self._updateExecution is not None:
+			self._updateExecution.cancel()
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _update(self, streaming, cancellation):
+		self._devices.begin_scan()
+		if self._prober is not None:
+			# Probes would only be fighting the inquiry for the radio
+			self._prober.pause()
+		try:
+			contacts = yield (
+				self._backend.get_contacts,
+				(),
+				{"streaming": streaming, "cancellation": cancellation},
+			)
+		except gobject_utils.CancelledError, e:
+			_moduleLogger.info("Update cancelled")
+			self._devices.abort_scan()
+			self._complete_update(None, e)
+			return
+		except Exception, e:
+			_moduleLogger.exception("Update failed")
+			self._devices.abort_scan()
+			self._complete_update(None, e)
+			return
+		finally:
+			if self._prober is not None:
+				self._prober.resume()
+
+		addedContacts = set()
+		changedContacts = set()
+		if not streaming:
+			for address, deviceclass, name in contacts:
+				address, result = self._observe(address, deviceclass, name)
+				if result is device_table.DeviceTable.ADDED:
+					addedContacts.add(address)
+				elif result is device_table.DeviceTable.CHANGED:
+					changedContacts.add(address)
+		# else everything in contacts was already observed as it streamed in
+		changedContacts.update(self._refresh_proximity(contacts) - addedContacts)
+		for address in self._answeredProbes:
+			# Inquiries regularly miss devices a page still reaches
+			self._devices.touch(address)
+		self._answeredProbes.clear()
+		removedContacts = self._devices.end_scan()
+		self._untrack_contacts(removedContacts)
+		self._cache.save()
+
+		self._track_contacts(addedContacts)
 
 		if addedContacts or removedContacts or changedContacts:
-			message = self, addedContacts, removedContacts, changedContacts
 			self.emit("contacts_changed", addedContacts, removedContacts, changedContacts)
 
+		stats = {
+			"changes": self._streamedChangeCount + len(addedContacts) + len(removedContacts) + len(changedContacts),
+			"total": len(self._devices),
+		}
+		self._streamedChangeCount = 0
+		self._complete_update(stats, None)
+		self.emit("update_complete", stats)
+
+	def _complete_update(self, stats, error):
+		self._updateExecution = None
+		waiters, self._updateWaiters = self._updateWaiters, []
+		if error is None:
+			self._lastUpdateTime = time.time()
+			self._lastUpdateStats = stats
+		for on_success, on_error in waiters:
+			try:
+				if error is None:
+					if on_success is not None:
+						on_success(stats)
+				elif on_error is not None:
+					on_error(error)
+			except Exception:
+				_moduleLogger.exception("Update waiter failed")
+
 	def get_addresses(self):
-		return self._addresses.iterkeys()
+		return self._devices.iterkeys()
+
+	def has_contact(self, address):
+		return address in self._devices
+
+	def is_contact_reachable(self, address):
+		"""
+		@returns False if the device didn't answer its last probe
+		"""
+		return address not in self._unreachable
+
+	def get_contact_proximity(self, address):
+		"""
+		@returns One of the protocol.proximity.BAND_* constants
+		"""
+		return self._backend.proximity.get_band(address)
 
 	def get_contact_name(self, address):
-		return self._addresses[address]["name"]
-
-	def _populate_contacts(self, contacts):
-		addresses = {}
-		for address, deviceclass, name in contacts:
-			_moduleLogger.debug("%r %r %r" % (address, deviceclass, name))
-			addresses[address] = {
-				"name": name,
-				"class": deviceclass,
-			}
-		return addresses
+		name = self._devices[address].name
+		if name is None:
+			# Still waiting on the name resolver
+			name = address
+		return name
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_contact_discovered(self, backend, address, deviceclass, name):
+		address, result = self._observe(address, deviceclass, name)
+		if result is device_table.DeviceTable.ADDED:
+			addedContacts, changedContacts = set((address, )), set()
+			self._track_contacts(addedContacts)
+		elif result is device_table.DeviceTable.CHANGED:
+			addedContacts, changedContacts = set(), set((address, ))
+		else:
+			return
+		self._streamedChangeCount += 1
+		self.emit("contacts_changed", addedContacts, set(), changedContacts)
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_name_resolved(self, nameResolver, address, name):
+		contact = self._devices.get(address, None)
+		if contact is None or not self._devices.replace(contact.replace(name=name)):
+			return
+		self._cache.update_device(address, contact.deviceClass, name)
+		self.emit("contacts_changed", set(), set(), set((address, )))
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_probed(self, prober, address, name):
+		contact = self._devices.get(address, None)
+		if contact is None:
+			return
+
+		isChanged = False
+		isReachable = name is not None
+		if isReachable:
+			# The next update counts it as seen even if its inquiry misses it
+			self._answeredProbes.add(address)
+			if self._devices.replace(contact.replace(name=name)):
+				self._cache.update_device(address, contact.deviceClass, name)
+				isChanged = True
+		else:
+			self._answeredProbes.discard(address)
+		if isReachable == (address in self._unreachable):
+			if isReachable:
+				self._unreachable.discard(address)
+			else:
+				self._unreachable.add(address)
+			isChanged = True
+
+		if isChanged:
+			self.emit("contacts_changed", set(), set(), set((address, )))
+
+	def _observe(self, address, deviceclass, name):
+		"""
+		@returns (address, DeviceTable.ADDED/CHANGED/None)
+		"""
+		contact = self._populate_contact(address, deviceclass, name)
+		address = str(contact.address)
+		oldContact = self._devices.get(address, None)
+		result = self._devices.observe(contact)
+		self._cache.update_device(address, contact.deviceClass, contact.name)
+		if result is device_table.DeviceTable.CHANGED:
+			self._invalidate_services(address, oldContact, contact)
+		return address, result
+
+	def _refresh_proximity(self, contacts):
+		"""
+		@returns set(address) of the devices whose proximity band moved, the
+			signal strengths only being known once the inquiry is over
+		"""
+		tracker = self._backend.proximity
+		moved = set()
+		for contact in contacts:
+			address = str(records.BluetoothAddress(contact[0]))
+			if address not in self._devices:
+				continue
+			band = tracker.get_band(address)
+			if self._bands.get(address, proximity.BAND_UNKNOWN) != band:
+				self._bands[address] = band
+				moved.add(address)
+		return moved
+
+	def _invalidate_services(self, address, oldContact, newContact):
+		# A new device class most likely means new services
+		if oldContact.deviceClass != newContact.deviceClass:
+			self._backend.serviceCache.invalidate(address)
+
+	def _track_contacts(self, addresses):
+		for address in addresses:
+			if self._devices[address].name is None:
+				self._nameResolver.request(address)
+			if self._prober is not None:
+				self._prober.add(address)
+
+	def _untrack_contacts(self, addresses):
+		for address in addresses:
+			self._backend.forget_device(address)
+			self._bands.pop(address, None)
+			self._unreachable.discard(address)
+			self._answeredProbes.discard(address)
+			if self._prober is not None:
+				self._prober.remove(address)
+
+	def _populate_contact(self, address, deviceclass, name):
+		if name is None:
+			# Inquiries no longer look up names, hold onto what the name
+			# resolver found last time
+			oldContact = self._devices.get(str(records.BluetoothAddress(address)), None)
+			if oldContact is not None:
+				name = oldContact.name
+		return records.DeviceRecord(address, name, deviceclass)
 
 
 gobject.type_register(Addressbook)
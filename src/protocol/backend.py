@@ -1,27 +1,41 @@
 #!/usr/bin/python
 
 """
-Resources:
-http://code.google.com/p/pybluez/
-http://lightblue.sourceforge.net/
-http://code.google.com/p/python-bluetooth-scanner
+What every backend shares, the connections handed out and the bookkeeping
+above the bluetooth stack.  Nothing here needs PyBluez, that is left to
+bluez_backend, so the simulated backend runs without it.
 """
 
 from __future__ import with_statement
 
+import time
+import Queue
 import select
+import socket
+import threading
 import logging
 
-import bluetooth
 import gobject
 
 import util.misc as misc_utils
+import util.go_utils as gobject_utils
+
+import proximity
+import service_cache
 
 
 _moduleLogger = logging.getLogger(__name__)
 
 
 class _BluetoothConnection(gobject.GObject):
+	"""
+	Without a framing set, consumers get "data_ready" and read the socket
+	themselves.  With one, reads go into a reusable receive buffer and
+	complete frames are handed out through "frame_received".  Writes are
+	always queued and flushed as the socket becomes writable, with
+	"write_paused"/"write_resumed" signalling when the queue crosses the
+	high/low watermarks.
+	"""
 
 	__gsignals__ = {
 		'data_ready' : (
@@ -29,6 +43,21 @@ class _BluetoothConnection(gobject.GObject):
 			gobject.TYPE_NONE,
 			(),
 		),
+		'frame_received' : (
+			gobject.SIGNAL_RUN_LAST,
+			gobject.TYPE_NONE,
+			(gobject.TYPE_PYOBJECT, ),
+		),
+		'write_paused' : (
+			gobject.SIGNAL_RUN_LAST,
+			gobject.TYPE_NONE,
+			(),
+		),
+		'write_resumed' : (
+			gobject.SIGNAL_RUN_LAST,
+			gobject.TYPE_NONE,
+			(),
+		),
 		'closed' : (
 			gobject.SIGNAL_RUN_LAST,
 			gobject.TYPE_NONE,
@@ -36,21 +65,96 @@ class _BluetoothConnection(gobject.GObject):
 		),
 	}
 
-	def __init__(self, socket, addr, protocol):
+	_READ_SIZE = 4096
+	_INITIAL_RX_BUFFER_SIZE = 4 * _READ_SIZE
+	_WRITE_SIZE = 4096
+	WRITE_HIGH_WATERMARK = 64 * 1024
+	WRITE_LOW_WATERMARK = 16 * 1024
+
+	def __init__(self, socket, addr, protocol, poolKey = None):
+		"""
+		@param poolKey (address, port, transport) for outgoing connections that
+			can be handed back to the connection pool
+		"""
 		gobject.GObject.__init__(self)
 		self._socket = socket
 		self._address = addr
-		self._dataId = gobject.io_add_watch (self._socket, gobject.IO_IN, self._on_data)
+		self._attachId = None
+		self._dataId = None
+		self._writeId = None
 		self._protocol = protocol
+		self._poolKey = poolKey
+
+		self._framing = None
+		# Reads land in place, only growing when a partial frame leaves less
+		# than _READ_SIZE free.  PyBluez sockets lack recv_into, for them
+		# each recv is copied straight into the buffer instead.
+		self._rxBuffer = bytearray(self._INITIAL_RX_BUFFER_SIZE)
+		self._rxView = memoryview(self._rxBuffer)
+		self._rxEnd = 0
+		self._canRecvInto = hasattr(socket, "recv_into")
+		self._txBuffer = bytearray()
+		self._isReadingPaused = False
+		self._isWritePaused = False
+		self._attach()
 
 	def close(self):
-		gobject.source_remove(self._dataId)
-		self._dataId = None
+		if self._socket is None:
+			return
+		self._unwatch()
+		if self._writeId is not None:
+			gobject.source_remove(self._writeId)
+			self._writeId = None
+		self._rxEnd = 0
+		del self._txBuffer[:]
 
 		self._socket.close()
 		self._socket = None
 		self.emit("closed")
 
+	def set_framing(self, framing):
+		"""
+		@param framing A protocol.framing object or None to go back to raw
+			"data_ready" notifications
+		"""
+		self._framing = framing
+		self._rxEnd = 0
+
+	def pause_reading(self):
+		self._isReadingPaused = True
+		self._unwatch()
+
+	def resume_reading(self):
+		self._isReadingPaused = False
+		if self._dataId is None and self._socket is not None:
+			self._watch()
+
+	def write(self, data):
+		if self._socket is None:
+			# "closed" already told the writer, nothing left to send on
+			_moduleLogger.warning("Dropping write to closed connection %s" % (self._address, ))
+			return
+		if self._framing is not None:
+			data = self._framing.frame(data)
+		self._txBuffer.extend(data)
+		if self._writeId is None:
+			self._writeId = gobject.io_add_watch(self._socket, gobject.IO_OUT, self._on_writable)
+		if not self._isWritePaused and self.WRITE_HIGH_WATERMARK < len(self._txBuffer):
+			self._isWritePaused = True
+			self.emit("write_paused")
+
+	@property
+	def pendingWriteSize(self):
+		return len(self._txBuffer)
+
+	@property
+	def isWritePaused(self):
+		return self._isWritePaused
+
+	@property
+	def poolKey(self):
+		return self._poolKey
+
 	@property
 	def socket(self):
 		return self._socket
@@ -63,132 +167,247 @@ class _BluetoothConnection(gobject.GObject):
 	def protocol(self):
 		return self._protocol
 
-	@misc_utils.log_exception(_moduleLogger)
-	def _on_data(self, source, condition):
-		self.emit("data_ready")
-		return True
-
-
-gobject.type_register(_BluetoothConnection)
+	def _attach(self):
+		"""
+		Start watching the socket from the main loop, connections being
+		created and checked out of the pool on the worker threads too
+		"""
+		self._attachId = gobject.idle_add(self._on_attach)
 
-
-class _BluetoothListener(gobject.GObject):
-
-	__gsignals__ = {
-		'incoming_connection' : (
-			gobject.SIGNAL_RUN_LAST,
-			gobject.TYPE_NONE,
-			(gobject.TYPE_PYOBJECT, ),
-		),
-		'start_listening' : (
-			gobject.SIGNAL_RUN_LAST,
-			gobject.TYPE_NONE,
-			(),
-		),
-		'stop_listening' : (
-			gobject.SIGNAL_RUN_LAST,
-			gobject.TYPE_NONE,
-			(),
-		),
-	}
-
-	def __init__(self, protocol, timeout):
-		gobject.GObject.__init__(self)
-		self._timeout = timeout
-		self._protocol = protocol
-		self._socket = None
-		self._incomingId = None
-
-	def start(self):
-		assert self._socket is None and self._incomingId is None
-		self._socket = bluetooth.BluetoothSocket(self._protocol["transport"])
-		self._socket.settimeout(self._timeout)
-		self._socket.bind(("", bluetooth.PORT_ANY))
-		self._socket.listen(1)
-		self._incomingId = gobject.io_add_watch(
-			self._socket, gobject.IO_IN, self._on_incoming
-		)
-
-		bluetooth.advertise_service(self._socket, self._protocol["name"], self._protocol["uuid"])
-		self.emit("start_listening")
-
-	def stop(self):
-		if self._socket is None or self._incomingId is None:
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_attach(self):
+		self._attachId = None
+		if self._socket is not None and self._dataId is None:
+			self._watch()
+		return False
+
+	def _watch(self):
+		assert self._dataId is None
+		if self._isReadingPaused:
 			return
-		gobject.source_remove(self._incomingId)
-		self._incomingId = None
+		self._dataId = gobject.io_add_watch(self._socket, gobject.IO_IN, self._on_data)
 
-		bluetooth.stop_advertising(self._socket)
-		self._socket.close()
-		self._socket = None
-		self.emit("stop_listening")
-
-	@property
-	def isListening(self):
-		return self._socket is not None and self._incomingId is not None
-
-	@property
-	def socket(self):
-		assert self._socket is not None
-		return self._socket
+	def _unwatch(self):
+		if self._attachId is not None:
+			gobject.source_remove(self._attachId)
+			self._attachId = None
+		if self._dataId is not None:
+			gobject.source_remove(self._dataId)
+			self._dataId = None
 
 	@misc_utils.log_exception(_moduleLogger)
-	def _on_incoming(self, source, condition):
-		newSocket, (address, port) = self._socket.accept()
-		newSocket.settimeout(self._timeout)
-		connection = _BluetoothConnection(newSocket, address, self._protocol)
-		self.emit("incoming_connection", connection)
-		return True
-
-
-gobject.type_register(_BluetoothListener)
+	def _on_data(self, source, condition):
+		if self._framing is None:
+			self.emit("data_ready")
+			return True
 
+		if len(self._rxBuffer) - self._rxEnd < self._READ_SIZE:
+			self._grow_rx_buffer()
+		try:
+			received = self._recv_into(self._rxView[self._rxEnd:])
+		except (socket.error, IOError), e:
+			_moduleLogger.error("Reading from %s failed: %s" % (self._address, e))
+			self._dataId = None
+			self.close()
+			return False
+		if not received:
+			_moduleLogger.info("Remote end %s closed the connection" % (self._address, ))
+			self._dataId = None
+			self.close()
+			return False
+		self._rxEnd += received
 
-class _DeviceDiscoverer(bluetooth.DeviceDiscoverer):
+		try:
+			frames, consumed = self._framing.extract_frames(self._rxBuffer, self._rxEnd)
+		except ValueError:
+			_moduleLogger.exception("Corrupt stream from %s" % (self._address, ))
+			self._dataId = None
+			self.close()
+			return False
+		if consumed:
+			# Only the trailing partial frame, if any, gets moved
+			remaining = self._rxEnd - consumed
+			self._rxView[:remaining] = self._rxView[consumed:self._rxEnd]
+			self._rxEnd = remaining
+		for frame in frames:
+			self.emit("frame_received", frame)
+			if self._socket is None:
+				# A handler closed us
+				return False
+		return self._dataId is not None
+
+	def _recv_into(self, view):
+		"""
+		@returns Bytes read into view, 0 when the remote end hung up
+		"""
+		if self._canRecvInto:
+			return self._socket.recv_into(view, len(view))
+		data = self._socket.recv(min(len(view), self._READ_SIZE))
+		view[:len(data)] = data
+		return len(data)
+
+	def _grow_rx_buffer(self):
+		# The exported view pins the bytearray's size, so swap in a new one
+		rxBuffer = bytearray(2 * len(self._rxBuffer))
+		rxBuffer[:self._rxEnd] = self._rxView[:self._rxEnd]
+		self._rxBuffer = rxBuffer
+		self._rxView = memoryview(rxBuffer)
 
-	def __init__(self, timeout):
-		bluetooth.DeviceDiscoverer.__init__(self)
-		self._timeout = timeout
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_writable(self, source, condition):
+		# buffer() to hand the socket a slice without copying it out
+		try:
+			sent = self._socket.send(buffer(self._txBuffer, 0, self._WRITE_SIZE))
+		except (socket.error, IOError), e:
+			_moduleLogger.error("Writing to %s failed: %s" % (self._address, e))
+			self._writeId = None
+			self.close()
+			return False
+		del self._txBuffer[:sent]
 
-		self._devices = []
-		self._devicesInProgress = []
+		if self._isWritePaused and len(self._txBuffer) <= self.WRITE_LOW_WATERMARK:
+			self._isWritePaused = False
+			self.emit("write_resumed")
 
-	@property
-	def devices(self):
-		return self._devices
+		if self._txBuffer:
+			return True
+		self._writeId = None
+		return False
 
-	def find_devices(self, *args, **kwds):
-		# Ensure we always start clean and is the reason we overroad this
-		self._devicesInProgress = []
 
-		newArgs = [self]
-		newArgs.extend(args)
-		bluetooth.DeviceDiscoverer.find_devices(*newArgs, **kwds)
+gobject.type_register(_BluetoothConnection)
 
-	def process_inquiry(self):
-		# The default impl calls into some hci code but an example used select,
-		# so going with the example
 
-		while self.is_inquiring or 0 < len(self.names_to_find):
-			# The whole reason for overriding this
-			_moduleLogger.debug("Event (%r, %r)"% (self.is_inquiring, self.names_to_find))
-			rfds = select.select([self], [], [], self._timeout)[0]
-			if self in rfds:
-				self.process_event()
+def _is_connection_alive(connection):
+	"""
+	An idle link should have nothing to say, being readable means either the
+	remote end hung up or we would be picking up someone else's data
+	"""
+	try:
+		readable, _, errored = select.select([connection.socket], [], [connection.socket], 0)
+	except (select.error, socket.error, IOError):
+		return False
+	return not readable and not errored
+
+
+class _ConnectionPool(object):
+	"""
+	Keeps released outgoing links around, keyed by (address, port,
+	transport), so repeat requests to the same device skip the page and
+	connect.  Checkout may come from the worker threads while checkin and
+	eviction happen on the main loop, so checkout leaves adding and removing
+	IO watches to the main loop.
+	"""
+
+	def __init__(self, idleTimeout = 60, maxIdlePerKey = 2):
+		self._idleTimeout = idleTimeout
+		self._maxIdlePerKey = maxIdlePerKey
+		self._lock = threading.Lock()
+		self._idle = {}
+		self._eviction = gobject_utils.Timeout(self._on_evict)
+
+	def checkout(self, key):
+		"""
+		@returns A healthy idle connection or None
+		"""
+		while True:
+			with self._lock:
+				idle = self._idle.get(key, None)
+				if not idle:
+					return None
+				_, connection = idle.pop()
+				if not idle:
+					del self._idle[key]
+			if _is_connection_alive(connection):
+				_moduleLogger.debug("Reusing connection to %r" % (key, ))
+				connection._attach()
+				return connection
+			_moduleLogger.debug("Discarding dead connection to %r" % (key, ))
+			gobject_utils.async(connection.close)()
+
+	def checkin(self, connection):
+		key = connection.poolKey
+		assert key is not None
+		connection._unwatch()
+		connection._isReadingPaused = False
+		connection.set_framing(None)
+		with self._lock:
+			idle = self._idle.setdefault(key, [])
+			if connection.pendingWriteSize == 0 and len(idle) < self._maxIdlePerKey:
+				idle.append((time.time(), connection))
+				connection = None
+		if connection is not None:
+			connection.close()
+		elif not self._eviction.is_running():
+			self._eviction.start(seconds=self._idleTimeout)
 
-	@misc_utils.log_exception(_moduleLogger)
-	def device_discovered(self, address, deviceclass, name):
-		device = address, deviceclass, name
-		_moduleLogger.debug("Device Discovered %r" % (device, ))
-		self._devicesInProgress.append(device)
+	def close(self):
+		self._eviction.cancel()
+		with self._lock:
+			idle = self._idle
+			self._idle = {}
+		for connections in idle.itervalues():
+			for _, connection in connections:
+				connection.close()
 
 	@misc_utils.log_exception(_moduleLogger)
-	def inquiry_complete(self):
-		_moduleLogger.debug("Inquiry Complete")
-		self._devices = self._devicesInProgress
+	def _on_evict(self):
+		cutoff = time.time() - self._idleTimeout
+		expired = []
+		with self._lock:
+			for key, idle in self._idle.items():
+				expired.extend(connection for (releasedAt, connection) in idle if releasedAt <= cutoff)
+				idle[:] = [entry for entry in idle if cutoff < entry[0]]
+				if not idle:
+					del self._idle[key]
+			hasIdle = bool(self._idle)
+		for connection in expired:
+			connection.close()
+		if hasIdle:
+			self._eviction.start(seconds=self._idleTimeout)
+
+
+class _AdapterTask(object):
+
+	def __init__(self, func, args, kwds):
+		self._func = func
+		self._args = args
+		self._kwds = kwds
+		self._done = threading.Event()
+		self._result = None
+		self._error = None
 
+	@property
+	def isDone(self):
+		return self._done.isSet()
 
-class BluetoothBackend(gobject.GObject):
+	def run(self):
+		try:
+			self._result = self._func(*self._args, **self._kwds)
+		except Exception, e:
+			self._error = e
+		self._done.set()
+
+	def wait(self, timeout = None):
+		"""
+		@param timeout Seconds to wait, None for as long as it takes
+		@returns What the task returned
+		@raises What the task raised
+		@raises util.go_utils.StepTimeoutError When it isn't done in time
+		"""
+		self._done.wait(timeout)
+		if not self._done.isSet():
+			raise gobject_utils.StepTimeoutError("Task still running after %s seconds" % (timeout, ))
+		if self._error is not None:
+			raise self._error
+		return self._result
+
+
+class Backend(gobject.GObject):
+	"""
+	The parts of a backend that don't depend on the bluetooth stack
+	underneath, subclasses fill in the rest
+	"""
 
 	__gsignals__ = {
 		'login' : (
@@ -206,97 +425,188 @@ class BluetoothBackend(gobject.GObject):
 			gobject.TYPE_NONE,
 			(gobject.TYPE_PYOBJECT, ),
 		),
+		'contact_discovered' : (
+			gobject.SIGNAL_RUN_LAST,
+			gobject.TYPE_NONE,
+			(gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT),
+		),
 	}
 
+	# How far past its own timeout a name lookup may run before it is assumed
+	# the stack is never going to answer
+	_NAME_LOOKUP_GRACE = 2
+
 	def __init__(self):
 		gobject.GObject.__init__(self)
-		self._disco = None
 		self._timeout = 8
-		self._listeners = {}
 		self._protocols = []
 		self._isListening = True
+		self._serviceCache = service_cache.ServiceCache()
+		self._connectionPool = _ConnectionPool()
+		# address -> [uuid] the device advertised while being discovered
+		self._advertisedServices = {}
+		self._proximity = proximity.ProximityTracker()
+		self._statsLock = threading.Lock()
+		self._nameLookups = 0
+		self._nameTimeouts = 0
+		self._nameSkips = 0
+		# Name lookups run one at a time on a single reused thread, so a stack
+		# that stops answering ties up that one thread and nothing more
+		self._nameLookupLock = threading.Lock()
+		self._nameQueue = Queue.Queue()
+		self._nameThread = None
+		self._stuckNameLookup = None
+
+	@property
+	def serviceCache(self):
+		return self._serviceCache
+
+	@property
+	def proximity(self):
+		return self._proximity
+
+	def get_advertised_services(self, address):
+		"""
+		@returns The service class uuids the device advertised during the last
+			inquiry to find it, None if it didn't advertise any
+		"""
+		return self._advertisedServices.get(address, None)
+
+	def forget_device(self, address):
+		"""
+		Drop what was learned about a device while discovering it, for when it
+		is no longer around
+		"""
+		self._advertisedServices.pop(address, None)
+		self._proximity.forget(address)
 
 	def add_protocol(self, protocol):
 		assert not self.is_logged_in()
 		self._protocols.append(protocol)
 
 	def login(self):
-		self._disco = _DeviceDiscoverer(self._timeout)
-
-		isListening = self._isListening
-		for protocol in self._protocols:
-			protoId = protocol["uuid"]
-			self._listeners[protoId] = _BluetoothListener(protocol, self._timeout)
-			if isListening:
-				self._listeners[protoId].start()
-
-		self.emit("login")
+		raise NotImplementedError()
 
 	def logout(self):
-		for protocol in self._protocols:
-			protoId = protocol["uuid"]
-			listener = self._listeners[protoId]
-			listener.close()
-		self._listeners.clear()
-		self._disco.cancel_inquiry() # precaution
-		self.emit("logout")
+		raise NotImplementedError()
 
 	def is_logged_in(self):
-		if self._listeners:
-			return True
-		else:
-			return False
+		raise NotImplementedError()
 
 	def is_listening(self):
 		return self._isListening
 
 	def enable_listening(self, enable):
-		if enable:
-			for listener in self._listeners.itervalues():
-				assert not listener.isListening
-			for listener in self._listeners.itervalues():
-				listener.start()
-		else:
-			for listener in self._listeners.itervalues():
-				assert listener.isListening
-			for listener in self._listeners.itervalues():
-				listener.stop()
-
-	def get_contacts(self):
-		try:
-			self._disco.find_devices(
-				duration=self._timeout,
-				flush_cache = True,
-				lookup_names = True,
-			)
-			self._disco.process_inquiry()
-		except bluetooth.BluetoothError, e:
-			# lightblue does this, so I guess I will too
-			_moduleLogger.error("Error while getting contacts, attempting to cancel")
+		raise NotImplementedError()
+
+	def get_contacts(self, streaming=False, cancellation=None):
+		"""
+		@param streaming When set, "contact_discovered" is emitted on the main
+			loop for each device as the inquiry finds it, rather than callers
+			having to wait for the complete list
+		@param cancellation util.go_utils.CancellationToken to abort the
+			inquiry with
+		@returns [(address, deviceclass, name)]
+		"""
+		raise NotImplementedError()
+
+	def lookup_name(self, address, timeout):
+		"""
+		Lookups still running _NAME_LOOKUP_GRACE past timeout are abandoned so
+		a stack that never answers can't tie up the name resolver or the
+		prober.  Until the abandoned one finally returns, further lookups are
+		skipped rather than queued up behind it.
+
+		@returns The remote name or None if the device did not answer
+		"""
+		with self._nameLookupLock:
+			stuck = self._stuckNameLookup
+			if stuck is not None:
+				if not stuck.isDone:
+					with self._statsLock:
+						self._nameSkips += 1
+					_moduleLogger.debug("Skipping the name of %s, a lookup is still stuck" % (address, ))
+					return None
+				self._stuckNameLookup = None
+
+			with self._statsLock:
+				self._nameLookups += 1
+			if self._nameThread is None:
+				self._nameThread = threading.Thread(name = "NameLookup", target = self._consume_name_lookups)
+				self._nameThread.setDaemon(True)
+				self._nameThread.start()
+			task = _AdapterTask(self._lookup_name, (address, timeout), {})
+			self._nameQueue.put(task)
 			try:
-				self._disco.cancel_inquiry()
-			finally:
-				raise e
-
-		return self._disco.devices
+				return task.wait(timeout + self._NAME_LOOKUP_GRACE)
+			except gobject_utils.StepTimeoutError:
+				with self._statsLock:
+					self._nameTimeouts += 1
+				self._stuckNameLookup = task
+				_moduleLogger.warning("Gave up on the name of %s" % (address, ))
+				return None
 
-	def get_contact_services(self, address):
-		services = bluetooth.find_service(address = address)
-		return services
+	@misc_utils.log_exception(_moduleLogger)
+	def _consume_name_lookups(self):
+		while True:
+			task = self._nameQueue.get()
+			task.run()
+
+	def _lookup_name(self, address, timeout):
+		raise NotImplementedError()
+
+	def get_contact_services(self, address, uuid = None):
+		raise NotImplementedError()
+
+	def get_inquiry_stats(self):
+		"""
+		@returns {name: count} of inquiries and name lookups, of the ones
+			that had to be abandoned and of the lookups skipped while one was
+			stuck
+		"""
+		with self._statsLock:
+			return {
+				"name_lookups": self._nameLookups,
+				"name_timeouts": self._nameTimeouts,
+				"name_skips": self._nameSkips,
+			}
+
+	def connect_device(self, addr, transport, port, cancellation=None):
+		"""
+		@param cancellation util.go_utils.CancellationToken to abort the
+			blocking connect with
+		"""
+		raise NotImplementedError()
+
+	def connect_device_async(self, addr, transport, port, on_success, on_error, cancellation=None):
+		"""
+		Main loop friendly version of connect_device, callbacks are always called
+		from the main loop
+		"""
+		raise NotImplementedError()
+
+	def release_connection(self, connection):
+		"""
+		Done with an outgoing connection, keep it around for reuse.  Callers
+		should disconnect their signal handlers first.
+		"""
+		if connection.poolKey is None:
+			connection.close()
+		else:
+			self._connectionPool.checkin(connection)
 
-	def connect(self, addr, transport, port):
-		sock = bluetooth.BluetoothSocket(transport)
-		sock.settimeout(self._timeout)
-		try:
-			sock.connect((addr, port))
-		except bluetooth.error, e:
-			sock.close()
-			raise
+	def _create_connection(self, sock, addr, protocol, poolKey = None):
+		return _BluetoothConnection(sock, addr, protocol, poolKey)
 
-		return _BluetoothConnection(sock, addr, "")
+	@gobject_utils.async
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_device_discovered(self, address, deviceclass, name):
+		# Called from the inquiry thread, the decorator bounces us back to the
+		# main loop before anyone sees the signal
+		self.emit("contact_discovered", address, deviceclass, name)
 
 
-gobject.type_register(BluetoothBackend)
+gobject.type_register(Backend)
 
 
 class BluetoothClass(object):
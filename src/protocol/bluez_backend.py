@@ -0,0 +1,757 @@
+#!/usr/bin/python
+
+"""
+The backend on top of BlueZ, through PyBluez
+
+Resources:
+http://code.google.com/p/pybluez/
+http://lightblue.sourceforge.net/
+http://code.google.com/p/python-bluetooth-scanner
+"""
+
+from __future__ import with_statement
+
+import os
+import re
+import time
+import errno
+import struct
+import select
+import socket
+import itertools
+import threading
+import Queue
+import logging
+
+import bluetooth
+import gobject
+
+import util.misc as misc_utils
+import util.go_utils as gobject_utils
+
+import records
+import eir
+import backend
+
+
+_moduleLogger = logging.getLogger(__name__)
+
+
+def _is_connect_in_progress(e):
+	# PyBluez flattens the errno into the message for some versions
+	code = e.args[0] if e.args else None
+	if isinstance(code, (int, long)):
+		return code in (errno.EINPROGRESS, errno.EAGAIN)
+	message = str(e)
+	return any(
+		(str(inProgress) in message or os.strerror(inProgress) in message)
+		for inProgress in (errno.EINPROGRESS, errno.EAGAIN)
+	)
+
+
+class _PendingConnect(object):
+	"""
+	A connect driven by the main loop, rather than blocking a worker
+	"""
+
+	def __init__(self, addr, transport, port, timeout, on_success, on_error, localAddress = "", cancellation = None):
+		"""
+		@param cancellation util.go_utils.CancellationToken, only held onto
+			until the connect completes
+		"""
+		self._addr = addr
+		self._localAddress = localAddress
+		self._transport = transport
+		self._port = port
+		self._timeout = timeout
+		self._on_success = on_success
+		self._on_error = on_error
+		self._cancellation = cancellation
+
+		self._socket = None
+		self._watchId = None
+		self._timer = gobject_utils.Timeout(self._on_timeout)
+
+	def start(self):
+		self._socket = bluetooth.BluetoothSocket(self._transport)
+		self._socket.setblocking(False)
+		try:
+			_bind_to_adapter(self._socket, self._localAddress)
+			self._socket.connect((self._addr, self._port))
+		except bluetooth.BluetoothError, e:
+			if not _is_connect_in_progress(e):
+				self._fail(e)
+				return
+		self._watchId = gobject.io_add_watch(
+			self._socket,
+			gobject.IO_OUT | gobject.IO_ERR | gobject.IO_HUP,
+			self._on_writable,
+		)
+		self._timer.start(seconds=self._timeout)
+		if self._cancellation is not None:
+			# Calls cancel straight away if already cancelled
+			self._cancellation.register(self.cancel)
+
+	def cancel(self):
+		if self._socket is None:
+			return
+		self._fail(gobject_utils.CancelledError("Connect to %s cancelled" % (self._addr, )))
+
+	def _cleanup(self):
+		if self._cancellation is not None:
+			self._cancellation.unregister(self.cancel)
+		self._timer.cancel()
+		if self._watchId is not None:
+			gobject.source_remove(self._watchId)
+			self._watchId = None
+		sock, self._socket = self._socket, None
+		return sock
+
+	def _fail(self, error):
+		sock = self._cleanup()
+		if sock is not None:
+			sock.close()
+		# Always report back from the main loop, even when failing from start
+		gobject.idle_add(self._report_error, error)
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _report_error(self, error):
+		self._on_error(error)
+		return False
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_writable(self, source, condition):
+		err = self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+		if err != 0:
+			self._fail(bluetooth.BluetoothError("(%d, %r)" % (err, os.strerror(err))))
+			return False
+
+		sock = self._cleanup()
+		sock.setblocking(True)
+		sock.settimeout(self._timeout)
+		connection = backend._BluetoothConnection(
+			sock, self._addr, "", (self._addr, self._port, self._transport)
+		)
+		self._on_success(connection)
+		return False
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_timeout(self):
+		self._fail(bluetooth.BluetoothError("Connect to %s timed out" % (self._addr, )))
+
+
+class _BluetoothListener(gobject.GObject):
+
+	__gsignals__ = {
+		'incoming_connection' : (
+			gobject.SIGNAL_RUN_LAST,
+			gobject.TYPE_NONE,
+			(gobject.TYPE_PYOBJECT, ),
+		),
+		'start_listening' : (
+			gobject.SIGNAL_RUN_LAST,
+			gobject.TYPE_NONE,
+			(),
+		),
+		'stop_listening' : (
+			gobject.SIGNAL_RUN_LAST,
+			gobject.TYPE_NONE,
+			(),
+		),
+	}
+
+	def __init__(self, protocol, timeout, localAddress = ""):
+		"""
+		@param localAddress Adapter to listen on, empty for any
+		"""
+		gobject.GObject.__init__(self)
+		self._timeout = timeout
+		self._protocol = protocol
+		self._localAddress = localAddress
+		self._socket = None
+		self._incomingId = None
+
+	def start(self):
+		assert self._socket is None and self._incomingId is None
+		self._socket = bluetooth.BluetoothSocket(self._protocol["transport"])
+		self._socket.settimeout(self._timeout)
+		self._socket.bind((self._localAddress, bluetooth.PORT_ANY))
+		self._socket.listen(1)
+		self._incomingId = gobject.io_add_watch(
+			self._socket, gobject.IO_IN, self._on_incoming
+		)
+
+		bluetooth.advertise_service(self._socket, self._protocol["name"], self._protocol["uuid"])
+		self.emit("start_listening")
+
+	def stop(self):
+		if self._socket is None or self._incomingId is None:
+			return
+		gobject.source_remove(self._incomingId)
+		self._incomingId = None
+
+		bluetooth.stop_advertising(self._socket)
+		self._socket.close()
+		self._socket = None
+		self.emit("stop_listening")
+
+	@property
+	def isListening(self):
+		return self._socket is not None and self._incomingId is not None
+
+	@property
+	def socket(self):
+		assert self._socket is not None
+		return self._socket
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_incoming(self, source, condition):
+		newSocket, (address, port) = self._socket.accept()
+		newSocket.settimeout(self._timeout)
+		connection = backend._BluetoothConnection(newSocket, address, self._protocol)
+		self.emit("incoming_connection", connection)
+		return True
+
+
+gobject.type_register(_BluetoothListener)
+
+
+class _DeviceDiscoverer(bluetooth.DeviceDiscoverer):
+
+	# How often to check for a cancellation request while waiting on events
+	_POLL_INTERVAL = 1
+	# Inquiry durations are in units of 1.28 seconds
+	_INQUIRY_UNIT = 1.28
+	# How far past its duration an inquiry may run before it is assumed the
+	# stack lost the completion event
+	_INQUIRY_GRACE = 5
+
+	def __init__(self, timeout, deviceId = None):
+		"""
+		@param deviceId Adapter to inquire with, None for the default one
+		"""
+		if deviceId is None:
+			bluetooth.DeviceDiscoverer.__init__(self)
+		else:
+			bluetooth.DeviceDiscoverer.__init__(self, device_id = deviceId)
+		self._deviceId = deviceId
+		self._timeout = timeout
+		self._isCancelRequested = False
+		self._inquiryMode = None
+		self._inquiryDeadline = None
+
+		self._devices = []
+		self._devicesInProgress = []
+		self._deviceIndexes = {}
+		self._services = {}
+		self._servicesInProgress = {}
+		self._rssiSamples = []
+		self._onDeviceDiscovered = None
+
+		# Only written by the inquiry thread
+		self._inquiryCount = 0
+		self._inquiryTimeouts = 0
+
+	@property
+	def devices(self):
+		return self._devices
+
+	@property
+	def advertisedServices(self):
+		"""
+		{address: [uuid]} from the EIRs of the last inquiry
+		"""
+		return self._services
+
+	@property
+	def rssiSamples(self):
+		"""
+		[(address, rssi)] reported during the last inquiry
+		"""
+		return self._rssiSamples
+
+	def get_stats(self):
+		return {
+			"inquiries": self._inquiryCount,
+			"inquiry_timeouts": self._inquiryTimeouts,
+		}
+
+	def find_devices(self, lookup_names = True, duration = 8, flush_cache = True, on_device_discovered = None):
+		# Ensure we always start clean and is the reason we overroad this
+		self._devicesInProgress = []
+		self._deviceIndexes = {}
+		self._servicesInProgress = {}
+		self._rssiSamples = []
+		self._onDeviceDiscovered = on_device_discovered
+		self._isCancelRequested = False
+		if self._inquiryMode is None:
+			self._inquiryMode = _enable_extended_inquiry(self._deviceId)
+
+		self._inquiryCount += 1
+		self._inquiryDeadline = time.time() + duration * self._INQUIRY_UNIT + self._INQUIRY_GRACE
+		bluetooth.DeviceDiscoverer.find_devices(
+			self,
+			lookup_names = lookup_names,
+			duration = duration,
+			flush_cache = flush_cache,
+		)
+
+	def process_inquiry(self):
+		"""
+		Runs until the inquiry finishes or overruns its deadline.  On
+		overrunning the inquiry is cancelled and whatever was found by then
+		becomes the result, so an adapter that never reports completion can't
+		tie up its worker forever.
+		"""
+		# The default impl calls into some hci code but an example used select,
+		# so going with the example
+
+		pollInterval = min(self._timeout, self._POLL_INTERVAL)
+		while self.is_inquiring or 0 < len(self.names_to_find):
+			if self._isCancelRequested:
+				_moduleLogger.info("Inquiry cancelled")
+				self.cancel_inquiry()
+				raise gobject_utils.CancelledError("Inquiry cancelled")
+
+			if self._inquiryDeadline <= time.time():
+				self._inquiryTimeouts += 1
+				_moduleLogger.warning("hci%s never completed its inquiry, giving up on it" % (self._deviceId, ))
+				self._abandon_inquiry()
+				break
+
+			# The whole reason for overriding this
+			_moduleLogger.debug("Event (%r, %r)"% (self.is_inquiring, self.names_to_find))
+			rfds = select.select([self], [], [], pollInterval)[0]
+			if self in rfds:
+				self.process_event()
+
+	def _abandon_inquiry(self):
+		try:
+			self.cancel_inquiry()
+		except bluetooth.BluetoothError, e:
+			_moduleLogger.error("Cancelling the inquiry on hci%s failed: %s" % (self._deviceId, e))
+		self.is_inquiring = False
+		self.names_to_find = {}
+		self.inquiry_complete()
+
+	def process_event(self):
+		"""
+		Handles the inquiry events here rather than in PyBluez, so results
+		with RSSI and EIR are understood whatever the PyBluez version
+		"""
+		packet = self.sock.recv(258)
+		_, event, _ = struct.unpack("BBB", packet[:3])
+		params = packet[3:]
+		if event in (
+			eir.EVT_INQUIRY_RESULT,
+			eir.EVT_INQUIRY_RESULT_WITH_RSSI,
+			eir.EVT_EXTENDED_INQUIRY_RESULT,
+		):
+			for address, deviceclass, rssi, response in eir.parse_inquiry_result(event, params):
+				name = None
+				if rssi is not None:
+					self._rssiSamples.append((address, rssi))
+				if response is not None:
+					name = response.name
+					if response.uuids:
+						self._servicesInProgress[address] = response.uuids
+				self.device_discovered(address, deviceclass, name)
+		elif event == eir.EVT_INQUIRY_COMPLETE:
+			self.is_inquiring = False
+			self.inquiry_complete()
+		elif event == eir.EVT_CMD_STATUS:
+			status, _, opcode = struct.unpack("<BBH", params[:4])
+			if opcode == _INQUIRY_OPCODE and status != 0:
+				_moduleLogger.error("Inquiry failed to start (%d)" % (status, ))
+				self.is_inquiring = False
+				self.inquiry_complete()
+
+	def request_cancel(self):
+		"""
+		Thread-safe, the inquiry thread notices within _POLL_INTERVAL
+		"""
+		self._isCancelRequested = True
+
+	@misc_utils.log_exception(_moduleLogger)
+	def device_discovered(self, address, deviceclass, name):
+		device = address, deviceclass, name
+		index = self._deviceIndexes.get(address, None)
+		if index is None:
+			self._deviceIndexes[address] = len(self._devicesInProgress)
+			self._devicesInProgress.append(device)
+		else:
+			# RSSI inquiries report devices repeatedly, only the first report
+			# to carry a name is news
+			if name is None or self._devicesInProgress[index][2] is not None:
+				return
+			self._devicesInProgress[index] = device
+		_moduleLogger.debug("Device Discovered %r" % (device, ))
+		if self._onDeviceDiscovered is not None:
+			self._onDeviceDiscovered(*device)
+
+	@misc_utils.log_exception(_moduleLogger)
+	def inquiry_complete(self):
+		_moduleLogger.debug("Inquiry Complete")
+		self._devices = self._devicesInProgress
+		self._services = self._servicesInProgress
+
+
+_OGF_HOST_CTL = 0x03
+_OCF_WRITE_INQUIRY_MODE = 0x0045
+# OGF_LINK_CTL (0x01) << 10 | OCF_INQUIRY (0x0001)
+_INQUIRY_OPCODE = 0x0401
+
+
+def _enable_extended_inquiry(deviceId):
+	"""
+	Ask the adapter for inquiry results with EIR, or failing that with RSSI.
+	Older adapters (and not having the permissions) leave it in the standard
+	mode where names still need a remote name request.
+
+	@returns The eir.INQUIRY_MODE_* the adapter is in
+	"""
+	try:
+		import bluetooth._bluetooth as _bt
+		if deviceId is None:
+			deviceId = _bt.hci_get_route()
+		hciSocket = _bt.hci_open_dev(deviceId)
+	except Exception:
+		_moduleLogger.exception("Could not open hci%s to set the inquiry mode" % (deviceId, ))
+		return eir.INQUIRY_MODE_STANDARD
+
+	try:
+		for mode in (eir.INQUIRY_MODE_EXTENDED, eir.INQUIRY_MODE_RSSI):
+			try:
+				response = _bt.hci_send_req(
+					hciSocket,
+					_OGF_HOST_CTL, _OCF_WRITE_INQUIRY_MODE,
+					_bt.EVT_CMD_COMPLETE, 1,
+					struct.pack("B", mode),
+				)
+			except Exception:
+				_moduleLogger.exception("Setting inquiry mode %d on hci%s failed" % (mode, deviceId))
+				continue
+			if ord(response[0]) == 0:
+				_moduleLogger.info("hci%s using inquiry mode %d" % (deviceId, mode))
+				return mode
+	finally:
+		hciSocket.close()
+	return eir.INQUIRY_MODE_STANDARD
+
+
+_SYSFS_ADAPTERS = "/sys/class/bluetooth"
+# Excludes the per-connection entries like hci0:12
+_ADAPTER_NAME = re.compile(r"^hci(\d+)$")
+
+
+def _read_adapter_address(deviceId):
+	"""
+	@returns The adapter's address or empty if it could not be read
+	"""
+	try:
+		import bluetooth._bluetooth as _bt
+		hciSocket = _bt.hci_open_dev(deviceId)
+		try:
+			response = _bt.hci_send_req(
+				hciSocket,
+				_bt.OGF_INFO_PARAM, _bt.OCF_READ_BD_ADDR,
+				_bt.EVT_CMD_COMPLETE, 7,
+			)
+		finally:
+			hciSocket.close()
+	except Exception:
+		_moduleLogger.exception("Could not read the address of hci%d" % (deviceId, ))
+		return ""
+	status, packedAddress = ord(response[0]), response[1:7]
+	if status != 0:
+		_moduleLogger.error("Reading the address of hci%d failed with %d" % (deviceId, status))
+		return ""
+	# Little endian on the wire
+	return records.unpack_address(packedAddress[::-1])
+
+
+def _enumerate_adapters():
+	"""
+	@returns [(deviceId, address)] of the local adapters, falling back to
+		[(None, "")] (the stack's default adapter) when they can't be listed
+	"""
+	try:
+		names = os.listdir(_SYSFS_ADAPTERS)
+	except OSError:
+		names = []
+	deviceIds = sorted(
+		int(match.group(1))
+		for match in (_ADAPTER_NAME.match(name) for name in names)
+		if match is not None
+	)
+	if not deviceIds:
+		return [(None, "")]
+	return [(deviceId, _read_adapter_address(deviceId)) for deviceId in deviceIds]
+
+
+def _bind_to_adapter(sock, localAddress):
+	if localAddress:
+		sock.bind((localAddress, 0))
+
+
+class _Adapter(object):
+	"""
+	A local adapter along with its own worker, so work that ties up an
+	adapter (inquiries) runs side by side across adapters
+	"""
+
+	def __init__(self, deviceId, address, timeout):
+		self._deviceId = deviceId
+		self._address = address
+		self._disco = _DeviceDiscoverer(timeout, deviceId)
+		self._queue = Queue.Queue()
+		self._thread = None
+
+	def __repr__(self):
+		return "_Adapter(%r, %r)" % (self._deviceId, self._address)
+
+	@property
+	def deviceId(self):
+		return self._deviceId
+
+	@property
+	def address(self):
+		return self._address
+
+	@property
+	def disco(self):
+		return self._disco
+
+	def start(self):
+		assert self._thread is None
+		self._thread = threading.Thread(
+			name = "Adapter-%s" % (self._deviceId, ),
+			target = self._consume_queue,
+		)
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+	def stop(self):
+		if self._thread is None:
+			return
+		self._queue.put(None)
+		self._thread = None
+
+	def submit(self, func, *args, **kwds):
+		"""
+		@returns backend._AdapterTask to wait on
+		"""
+		assert self._thread is not None
+		task = backend._AdapterTask(func, args, kwds)
+		self._queue.put(task)
+		return task
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _consume_queue(self):
+		while True:
+			task = self._queue.get()
+			if task is None:
+				break
+			task.run()
+
+
+class BluetoothBackend(backend.Backend):
+	"""
+	Backed by PyBluez and so BlueZ
+	"""
+
+	def __init__(self):
+		backend.Backend.__init__(self)
+		self._adapters = []
+		self._nextAdapter = itertools.count()
+		self._listeners = {}
+
+	def login(self):
+		self._adapters = [
+			_Adapter(deviceId, address, self._timeout)
+			for (deviceId, address) in _enumerate_adapters()
+		]
+		_moduleLogger.info("Using adapters %r" % (self._adapters, ))
+		for adapter in self._adapters:
+			adapter.start()
+
+		# An adapter whose address is unknown can only be listened on through
+		# the wildcard address, which covers every adapter
+		localAddresses = set(adapter.address for adapter in self._adapters)
+		if "" in localAddresses:
+			localAddresses = set(("", ))
+
+		isListening = self._isListening
+		for protocol in self._protocols:
+			protoId = protocol["uuid"]
+			for localAddress in localAddresses:
+				listener = _BluetoothListener(protocol, self._timeout, localAddress)
+				self._listeners[(protoId, localAddress)] = listener
+				if isListening:
+					listener.start()
+
+		self.emit("login")
+
+	def logout(self):
+		for listener in self._listeners.itervalues():
+			listener.stop()
+		self._listeners.clear()
+		self._connectionPool.close()
+		for adapter in self._adapters:
+			adapter.disco.cancel_inquiry() # precaution
+			adapter.stop()
+		self._adapters = []
+		self.emit("logout")
+
+	def is_logged_in(self):
+		if self._listeners:
+			return True
+		else:
+			return False
+
+	def enable_listening(self, enable):
+		if enable:
+			for listener in self._listeners.itervalues():
+				assert not listener.isListening
+			for listener in self._listeners.itervalues():
+				listener.start()
+		else:
+			for listener in self._listeners.itervalues():
+				assert listener.isListening
+			for listener in self._listeners.itervalues():
+				listener.stop()
+
+	def get_contacts(self, streaming=False, cancellation=None):
+		"""
+		Inquire on all adapters at once, merging what they found.  Devices
+		seen by several adapters are streamed once per adapter.
+		"""
+		tasks = [
+			(adapter, adapter.submit(self._inquire, adapter.disco, streaming, cancellation))
+			for adapter in self._adapters
+		]
+
+		devices = {}
+		errors = []
+		for adapter, task in tasks:
+			try:
+				adapterDevices = task.wait()
+			except gobject_utils.CancelledError:
+				raise
+			except bluetooth.BluetoothError, e:
+				_moduleLogger.error("Inquiry failed on %r: %s" % (adapter, e))
+				errors.append(e)
+				continue
+			for device in adapterDevices:
+				# Prefer whichever adapter got the name out of the EIR
+				if device[2] is not None or device[0] not in devices:
+					devices[device[0]] = device
+			self._advertisedServices.update(adapter.disco.advertisedServices)
+			self._proximity.record_batch(adapter.disco.rssiSamples)
+		if errors and len(errors) == len(tasks):
+			raise errors[0]
+		return devices.values()
+
+	def _inquire(self, disco, streaming, cancellation):
+		if streaming:
+			onDeviceDiscovered = self._on_device_discovered
+		else:
+			onDeviceDiscovered = None
+		try:
+			disco.find_devices(
+				duration=self._timeout,
+				flush_cache = True,
+				# Names are resolved separately, see name_resolver
+				lookup_names = False,
+				on_device_discovered = onDeviceDiscovered,
+			)
+			if cancellation is not None:
+				cancellation.register(disco.request_cancel)
+			try:
+				disco.process_inquiry()
+			finally:
+				if cancellation is not None:
+					cancellation.unregister(disco.request_cancel)
+		except bluetooth.BluetoothError, e:
+			# lightblue does this, so I guess I will too
+			_moduleLogger.error("Error while getting contacts, attempting to cancel")
+			try:
+				disco.cancel_inquiry()
+			finally:
+				raise e
+
+		return disco.devices
+
+	def _lookup_name(self, address, timeout):
+		return bluetooth.lookup_name(address, timeout=timeout)
+
+	def get_inquiry_stats(self):
+		"""
+		Inquiries summed across the adapters
+		"""
+		stats = backend.Backend.get_inquiry_stats(self)
+		for adapter in self._adapters:
+			for name, value in adapter.disco.get_stats().iteritems():
+				stats[name] = stats.get(name, 0) + value
+		return stats
+
+	def get_contact_services(self, address, uuid = None):
+		try:
+			services = self._serviceCache.get(address, uuid)
+		except KeyError:
+			services = bluetooth.find_service(uuid = uuid, address = address)
+			self._serviceCache.set(address, uuid, services)
+		return services
+
+	def connect_device(self, addr, transport, port, cancellation=None):
+		"""
+		Cancelling closes the socket out from under the blocking connect
+		"""
+		poolKey = addr, port, transport
+		connection = self._connectionPool.checkout(poolKey)
+		if connection is not None:
+			return connection
+
+		sock = bluetooth.BluetoothSocket(transport)
+		sock.settimeout(self._timeout)
+		if cancellation is not None:
+			cancellation.register(sock.close)
+		try:
+			_bind_to_adapter(sock, self._next_adapter().address)
+			sock.connect((addr, port))
+		except bluetooth.error, e:
+			sock.close()
+			if cancellation is not None and cancellation.isCancelled:
+				raise gobject_utils.CancelledError("Connect to %s cancelled" % (addr, ))
+			raise
+		finally:
+			if cancellation is not None:
+				cancellation.unregister(sock.close)
+
+		return self._create_connection(sock, addr, "", poolKey)
+
+	def connect_device_async(self, addr, transport, port, on_success, on_error, cancellation=None):
+		"""
+		The connect is driven by io watches rather than tying up a worker
+		thread
+		"""
+		poolKey = addr, port, transport
+		connection = self._connectionPool.checkout(poolKey)
+		if connection is not None:
+			gobject_utils.async(on_success)(connection)
+			return
+
+		pendingConnect = _PendingConnect(
+			addr, transport, port, self._timeout, on_success, on_error,
+			localAddress = self._next_adapter().address,
+			cancellation = cancellation,
+		)
+		pendingConnect.start()
+
+	def _next_adapter(self):
+		# Spread connects round robin across the adapters, count() being
+		# safe to share between the workers
+		return self._adapters[self._nextAdapter.next() % len(self._adapters)]
+
+
+gobject.type_register(BluetoothBackend)
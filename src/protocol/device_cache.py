@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""
+Remember what devices we have seen across sessions so the contact lists have
+something in them before the first inquiry finishes.
+"""
+
+from __future__ import with_statement
+
+import os
+import time
+import cPickle
+import logging
+
+
+_moduleLogger = logging.getLogger(__name__)
+
+
+class DeviceCache(object):
+
+	_VERSION = 1
+	# Seconds
+	DEFAULT_TTL = 7 * 24 * 60 * 60
+
+	def __init__(self, path, ttl = DEFAULT_TTL):
+		"""
+		@param path Where to persist the cache, None keeps it in memory only
+		"""
+		self._path = path
+		self._ttl = ttl
+		self._devices = {}
+		self._isDirty = False
+
+	def load(self):
+		self._devices = {}
+		self._isDirty = False
+		if self._path is None or not os.path.exists(self._path):
+			return
+
+		try:
+			with open(self._path, "rb") as f:
+				data = cPickle.load(f)
+		except Exception:
+			_moduleLogger.exception("Ignoring unreadable device cache %r" % (self._path, ))
+			return
+
+		version = data.get("version", None)
+		if version != self._VERSION:
+			_moduleLogger.info("Ignoring device cache with version %r (want %r)" % (version, self._VERSION))
+			return
+
+		now = time.time()
+		self._devices = dict(
+			(address, device)
+			for (address, device) in data["devices"].iteritems()
+			if not self._is_expired(device, now)
+		)
+		_moduleLogger.info("Loaded %d devices from the cache" % (len(self._devices), ))
+
+	def save(self):
+		if self._path is None or not self._isDirty:
+			return
+
+		now = time.time()
+		data = {
+			"version": self._VERSION,
+			"devices": dict(
+				(address, device)
+				for (address, device) in self._devices.iteritems()
+				if not self._is_expired(device, now)
+			),
+		}
+
+		# Write then rename so a crash never leaves a half written cache behind
+		tempPath = "%s.tmp" % self._path
+		try:
+			with open(tempPath, "wb") as f:
+				cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+				f.flush()
+				os.fsync(f.fileno())
+			os.rename(tempPath, self._path)
+		except Exception:
+			_moduleLogger.exception("Failed to save device cache %r" % (self._path, ))
+			return
+		self._isDirty = False
+
+	def get_devices(self):
+		"""
+		@returns [(address, deviceclass, name)] for each unexpired device
+		"""
+		now = time.time()
+		return [
+			(address, device["class"], device["name"])
+			for (address, device) in self._devices.iteritems()
+			if not self._is_expired(device, now)
+		]
+
+	def update_device(self, address, deviceclass, name):
+		device = self._devices.setdefault(address, {"services": None})
+		device["class"] = deviceclass
+		if name is not None:
+			device["name"] = name
+		else:
+			device.setdefault("name", None)
+		device["lastSeen"] = time.time()
+		self._isDirty = True
+
+	def get_services(self, address):
+		"""
+		@returns The service records as exported by the ServiceCache or None
+		"""
+		return self._devices[address]["services"]
+
+	def set_services(self, address, services):
+		device = self._devices.get(address, None)
+		if device is None or device["services"] == services:
+			return
+		device["services"] = services
+		self._isDirty = True
+
+	def _is_expired(self, device, now):
+		return self._ttl < now - device["lastSeen"]
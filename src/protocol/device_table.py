@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+"""
+The addressbook's view of the devices around us, kept so each scan only costs
+as much as what changed in it.  Every entry is versioned and remembers the
+scan (generation) it was last seen in, with the entries bucketed by that
+generation so finding the missing ones never walks the whole table.
+"""
+
+import records
+
+
+class DeviceTable(object):
+	"""
+	>>> table = DeviceTable(absenceThreshold=2)
+	>>> table.begin_scan()
+	1
+	>>> table.observe(records.DeviceRecord("00:00:00:00:00:01", None, 1))
+	'added'
+	>>> table.observe(records.DeviceRecord("00:00:00:00:00:02", None, 1))
+	'added'
+	>>> table.end_scan()
+	set([])
+	>>> table.begin_scan()
+	2
+	>>> table.observe(records.DeviceRecord("00:00:00:00:00:01", None, 1)) is None
+	True
+	>>> table.observe(records.DeviceRecord("00:00:00:00:00:01", "Phone", 1))
+	'changed'
+	>>> table.get_version("00:00:00:00:00:01")
+	2
+	>>> table.end_scan()
+	set([])
+	>>> table.begin_scan()
+	3
+	>>> table.touch("00:00:00:00:00:01")
+	True
+	>>> table.end_scan()
+	set(['00:00:00:00:00:02'])
+	>>> sorted(table.iterkeys()), len(table)
+	(['00:00:00:00:00:01'], 1)
+	"""
+
+	ADDED = "added"
+	CHANGED = "changed"
+
+	def __init__(self, absenceThreshold = 1):
+		"""
+		@param absenceThreshold How many scans in a row a device has to be
+			missing from before it is removed
+		"""
+		assert 1 <= absenceThreshold
+		self._absenceThreshold = absenceThreshold
+		self._generation = 0
+
+		# address -> DeviceRecord
+		self._records = {}
+		# address -> version, bumped on each change to the record
+		self._versions = {}
+		# address -> generation last seen in
+		self._lastSeen = {}
+		# generation -> set(address)
+		self._seenBuckets = {}
+
+	@property
+	def generation(self):
+		return self._generation
+
+	def __len__(self):
+		return len(self._records)
+
+	def __contains__(self, address):
+		return address in self._records
+
+	def __getitem__(self, address):
+		return self._records[address]
+
+	def get(self, address, default = None):
+		return self._records.get(address, default)
+
+	def iterkeys(self):
+		return self._records.iterkeys()
+
+	def get_version(self, address):
+		return self._versions[address]
+
+	def begin_scan(self):
+		"""
+		@returns The generation devices observed from now on are marked with
+		"""
+		self._generation += 1
+		return self._generation
+
+	def abort_scan(self):
+		"""
+		Give up on the current scan without it counting against the devices
+		missing from it, those seen during it count as seen in the last one
+
+		>>> table = DeviceTable(absenceThreshold=2)
+		>>> table.begin_scan()
+		1
+		>>> table.observe(records.DeviceRecord("00:00:00:00:00:01", None, 1))
+		'added'
+		>>> table.end_scan()
+		set([])
+		>>> table.begin_scan(), table.end_scan()
+		(2, set([]))
+		>>> table.begin_scan()
+		3
+		>>> table.abort_scan()
+		>>> table.generation
+		2
+		>>> table.begin_scan(), table.end_scan()
+		(3, set(['00:00:00:00:00:01']))
+		"""
+		aborted = self._seenBuckets.pop(self._generation, set())
+		self._generation -= 1
+		for address in aborted:
+			self._lastSeen[address] = self._generation
+		if aborted:
+			self._seenBuckets.setdefault(self._generation, set()).update(aborted)
+
+	def end_scan(self):
+		"""
+		Drop the devices that have now missed too many scans
+
+		@returns set(address) of the removed devices
+		"""
+		expiredGeneration = self._generation - self._absenceThreshold
+		# Only the last absenceThreshold + 1 generations have buckets around
+		expiredBuckets = [
+			generation
+			for generation in self._seenBuckets.iterkeys()
+			if generation <= expiredGeneration
+		]
+		removed = set()
+		for generation in expiredBuckets:
+			removed.update(self._seenBuckets.pop(generation))
+		for address in removed:
+			del self._records[address]
+			del self._versions[address]
+			del self._lastSeen[address]
+		return removed
+
+	def observe(self, record):
+		"""
+		Record that the device was seen in the current scan
+
+		@returns ADDED, CHANGED or None when nothing about it changed
+		"""
+		address = str(record.address)
+		self._mark_seen(address)
+		oldRecord = self._records.get(address, None)
+		if oldRecord is None:
+			self._records[address] = record
+			self._versions[address] = 1
+			return self.ADDED
+		elif oldRecord != record:
+			self._records[address] = record
+			self._versions[address] += 1
+			return self.CHANGED
+		else:
+			return None
+
+	def touch(self, address):
+		"""
+		Record that a known device was seen without it changing
+
+		@returns False if the device is unknown
+		"""
+		if address not in self._records:
+			return False
+		self._mark_seen(address)
+		return True
+
+	def replace(self, record):
+		"""
+		Update what is known about a device without counting it as seen
+
+		@returns False if the device is unknown or nothing changed
+		"""
+		address = str(record.address)
+		oldRecord = self._records.get(address, None)
+		if oldRecord is None or oldRecord == record:
+			return False
+		self._records[address] = record
+		self._versions[address] += 1
+		return True
+
+	def _mark_seen(self, address):
+		oldGeneration = self._lastSeen.get(address, None)
+		if oldGeneration == self._generation:
+			return
+		if oldGeneration is not None:
+			bucket = self._seenBuckets[oldGeneration]
+			bucket.discard(address)
+			if not bucket:
+				del self._seenBuckets[oldGeneration]
+		self._lastSeen[address] = self._generation
+		self._seenBuckets.setdefault(self._generation, set()).add(address)
+
+
+if __name__ == "__main__":
+	import doctest
+	print doctest.testmod()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+"""
+Parsing of the HCI inquiry result events and the Extended Inquiry Response
+(EIR) they can carry.  With EIR a device's name and the services it offers
+come back with the inquiry itself, rather than each needing its own page.
+
+Kept free of any bluetooth stack so it can be fed recorded events.
+"""
+
+import struct
+
+import records
+
+
+EVT_INQUIRY_COMPLETE = 0x01
+EVT_INQUIRY_RESULT = 0x02
+EVT_CMD_STATUS = 0x0F
+EVT_INQUIRY_RESULT_WITH_RSSI = 0x22
+EVT_EXTENDED_INQUIRY_RESULT = 0x2F
+
+INQUIRY_MODE_STANDARD = 0
+INQUIRY_MODE_RSSI = 1
+INQUIRY_MODE_EXTENDED = 2
+
+_EIR_UUID16_INCOMPLETE = 0x02
+_EIR_UUID16_COMPLETE = 0x03
+_EIR_UUID32_INCOMPLETE = 0x04
+_EIR_UUID32_COMPLETE = 0x05
+_EIR_UUID128_INCOMPLETE = 0x06
+_EIR_UUID128_COMPLETE = 0x07
+_EIR_NAME_SHORT = 0x08
+_EIR_NAME_COMPLETE = 0x09
+_EIR_TX_POWER = 0x0A
+
+_BASE_UUID_SUFFIX = "-0000-1000-8000-00805F9B34FB"
+
+
+def _format_uuid128(packed):
+	# Little endian on the wire
+	digits = "".join("%02X" % ord(byte) for byte in reversed(packed))
+	return "-".join((digits[0:8], digits[8:12], digits[12:16], digits[16:20], digits[20:32]))
+
+
+def _unpack_address(packed):
+	# Little endian on the wire
+	return records.unpack_address(packed[::-1])
+
+
+def _unpack_device_class(packed):
+	low, middle, high = struct.unpack("BBB", packed)
+	return (high << 16) | (middle << 8) | low
+
+
+def _unpack_rssi(packed):
+	return struct.unpack("b", packed)[0]
+
+
+class ExtendedInquiryResponse(object):
+	"""
+	>>> eir = parse_eir("\\x06\\x09Phone\\x05\\x03\\x05\\x11\\x1f\\x11\\x02\\x0a\\xfc\\x00\\x00")
+	>>> eir.name, eir.isNameComplete, eir.uuids, eir.txPower
+	('Phone', True, ['1105', '111F'], -4)
+	"""
+
+	__slots__ = ("name", "isNameComplete", "uuids", "isUuidListComplete", "txPower")
+
+	def __init__(self):
+		self.name = None
+		self.isNameComplete = False
+		self.uuids = []
+		self.isUuidListComplete = False
+		self.txPower = None
+
+	def __repr__(self):
+		return "ExtendedInquiryResponse(name=%r, uuids=%r, txPower=%r)" % (self.name, self.uuids, self.txPower)
+
+
+def parse_eir(data):
+	"""
+	@param data The EIR bytes, trailing zero padding included
+	@returns ExtendedInquiryResponse
+
+	Shortened names are only used if no complete one shows up
+	>>> parse_eir("\\x04\\x08Ph\\x00\\x07\\x09Phone2").name
+	'Phone2'
+	>>> eir = parse_eir("\\x03\\x08Ph")
+	>>> eir.name, eir.isNameComplete
+	('Ph', False)
+
+	UUIDs of all sizes, 32 bit and 16 bit ones in their short forms
+	>>> parse_eir("\\x05\\x05\\x01\\x00\\x01\\x00").uuids
+	['00010001']
+	>>> parse_eir("\\x11\\x07" + "".join(chr(i) for i in xrange(16))).uuids
+	['0F0E0D0C-0B0A-0908-0706-050403020100']
+
+	Truncated or empty responses give what could be read
+	>>> parse_eir("\\x06\\x09Ph").name is None
+	True
+	>>> parse_eir("").uuids
+	[]
+	"""
+	eir = ExtendedInquiryResponse()
+	offset = 0
+	dataLength = len(data)
+	while offset < dataLength:
+		fieldLength = ord(data[offset])
+		if fieldLength == 0:
+			# Start of the padding
+			break
+		fieldEnd = offset + 1 + fieldLength
+		if dataLength < fieldEnd:
+			break
+		fieldType = ord(data[offset + 1])
+		field = data[offset + 2:fieldEnd]
+		offset = fieldEnd
+
+		if fieldType == _EIR_NAME_COMPLETE:
+			eir.name = field.rstrip("\0")
+			eir.isNameComplete = True
+		elif fieldType == _EIR_NAME_SHORT:
+			if not eir.isNameComplete:
+				eir.name = field.rstrip("\0")
+		elif fieldType in (_EIR_UUID16_INCOMPLETE, _EIR_UUID16_COMPLETE):
+			eir.uuids.extend(
+				"%04X" % uuid
+				for uuid in struct.unpack("<%dH" % (len(field) // 2), field[:len(field) // 2 * 2])
+			)
+			eir.isUuidListComplete = fieldType == _EIR_UUID16_COMPLETE
+		elif fieldType in (_EIR_UUID32_INCOMPLETE, _EIR_UUID32_COMPLETE):
+			eir.uuids.extend(
+				"%08X" % uuid
+				for uuid in struct.unpack("<%dI" % (len(field) // 4), field[:len(field) // 4 * 4])
+			)
+			eir.isUuidListComplete = fieldType == _EIR_UUID32_COMPLETE
+		elif fieldType in (_EIR_UUID128_INCOMPLETE, _EIR_UUID128_COMPLETE):
+			eir.uuids.extend(
+				_format_uuid128(field[start:start + 16])
+				for start in xrange(0, len(field) - 15, 16)
+			)
+			eir.isUuidListComplete = fieldType == _EIR_UUID128_COMPLETE
+		elif fieldType == _EIR_TX_POWER and field:
+			eir.txPower = _unpack_rssi(field[0])
+	return eir
+
+
+def parse_inquiry_result(event, params):
+	"""
+	@param event One of the EVT_*INQUIRY_RESULT* codes
+	@param params The event's parameters, after the packet and event headers
+	@returns [(address, deviceclass, rssi, eir)], rssi and eir being None
+		when the event doesn't carry them
+
+	>>> parse_inquiry_result(EVT_INQUIRY_RESULT, "\\x01" "\\xcc\\xbb\\xaa\\x22\\x11\\x00" "\\x01" "\\x00\\x00" "\\x0c\\x02\\x5a" "\\x00\\x00")
+	[('00:11:22:AA:BB:CC', 5898764, None, None)]
+	>>> parse_inquiry_result(
+	...		EVT_INQUIRY_RESULT_WITH_RSSI,
+	...		"\\x02" "\\x01\\x00\\x00\\x00\\x00\\x00\\x02\\x00\\x00\\x00\\x00\\x00" "\\x01\\x01" "\\x00\\x00"
+	...		"\\x0c\\x02\\x5a\\x04\\x04\\x24" "\\x00\\x00\\x00\\x00" "\\xc4\\xd8",
+	... )
+	[('00:00:00:00:00:01', 5898764, -60, None), ('00:00:00:00:00:02', 2360324, -40, None)]
+	>>> results = parse_inquiry_result(
+	...		EVT_EXTENDED_INQUIRY_RESULT,
+	...		"\\x01" "\\xcc\\xbb\\xaa\\x22\\x11\\x00" "\\x01\\x00" "\\x0c\\x02\\x5a" "\\x00\\x00" "\\xc4"
+	...		"\\x06\\x09Phone" + "\\x00" * 233,
+	... )
+	>>> [(address, rssi, eir.name) for (address, deviceclass, rssi, eir) in results]
+	[('00:11:22:AA:BB:CC', -60, 'Phone')]
+	"""
+	if event == EVT_EXTENDED_INQUIRY_RESULT:
+		# Always a single response
+		address = _unpack_address(params[1:7])
+		deviceclass = _unpack_device_class(params[9:12])
+		rssi = _unpack_rssi(params[14])
+		return [(address, deviceclass, rssi, parse_eir(params[15:]))]
+
+	responseCount = ord(params[0])
+	if event == EVT_INQUIRY_RESULT:
+		classOffset = 1 + 9 * responseCount
+		rssiOffset = None
+	elif event == EVT_INQUIRY_RESULT_WITH_RSSI:
+		classOffset = 1 + 8 * responseCount
+		rssiOffset = 1 + 13 * responseCount
+	else:
+		raise ValueError("Not an inquiry result event: 0x%02X" % (event, ))
+
+	results = []
+	for i in xrange(responseCount):
+		address = _unpack_address(params[1 + 6 * i:7 + 6 * i])
+		deviceclass = _unpack_device_class(params[classOffset + 3 * i:classOffset + 3 * i + 3])
+		if rssiOffset is None:
+			rssi = None
+		else:
+			rssi = _unpack_rssi(params[rssiOffset + i])
+		results.append((address, deviceclass, rssi, None))
+	return results
+
+
+if __name__ == "__main__":
+	import doctest
+	print doctest.testmod()
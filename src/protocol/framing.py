@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+Ways of carving a byte stream into messages.  A framing pulls as many
+complete frames as it can from a receive buffer, leaving the compaction of
+the buffer to the caller so it happens once per read rather than once per
+frame.  Frames are copied out of the buffer exactly once, through a
+memoryview.
+"""
+
+import struct
+
+
+class LineFraming(object):
+	"""
+	>>> framing = LineFraming()
+	>>> framing.extract_frames(bytearray("hello\\nworld\\npartial"))
+	(['hello', 'world'], 12)
+	>>> framing.extract_frames(bytearray("partial"))
+	([], 0)
+	>>> framing.extract_frames(bytearray("hello\\nstale\\n"), 6)
+	(['hello'], 6)
+	>>> framing.frame("hello")
+	'hello\\n'
+	"""
+
+	def __init__(self, delimiter = "\n"):
+		self._delimiter = delimiter
+
+	def extract_frames(self, buffer, end = None):
+		"""
+		@param end How much of buffer holds data, all of it by default
+		@returns ([frame], bytesConsumed)
+		"""
+		if end is None:
+			end = len(buffer)
+		view = memoryview(buffer)
+		frames = []
+		start = 0
+		delimiterLength = len(self._delimiter)
+		while True:
+			frameEnd = buffer.find(self._delimiter, start, end)
+			if frameEnd == -1:
+				break
+			frames.append(view[start:frameEnd].tobytes())
+			start = frameEnd + delimiterLength
+		return frames, start
+
+	def frame(self, payload):
+		return payload + self._delimiter
+
+
+class LengthPrefixedFraming(object):
+	"""
+	Each frame is preceded by its length as a network order unsigned int
+
+	>>> framing = LengthPrefixedFraming()
+	>>> data = bytearray(framing.frame("hello") + framing.frame("") + framing.frame("wor"))
+	>>> framing.extract_frames(data)
+	(['hello', '', 'wor'], 20)
+	>>> framing.extract_frames(data[:11])
+	(['hello'], 9)
+	>>> framing.extract_frames(data, 11)
+	(['hello'], 9)
+	>>> framing.extract_frames(bytearray("\\xff\\xff\\xff\\xff"))
+	Traceback (most recent call last):
+	...
+	ValueError: Frame of 4294967295 bytes exceeds 65536
+	"""
+
+	_HEADER = struct.Struct("!I")
+
+	def __init__(self, maxFrameSize = 64 * 1024):
+		self._maxFrameSize = maxFrameSize
+
+	def extract_frames(self, buffer, end = None):
+		"""
+		@param end How much of buffer holds data, all of it by default
+		@returns ([frame], bytesConsumed)
+		@raises ValueError on a corrupt (oversized) length
+		"""
+		view = memoryview(buffer)
+		frames = []
+		start = 0
+		headerSize = self._HEADER.size
+		bufferSize = end if end is not None else len(buffer)
+		while headerSize <= bufferSize - start:
+			frameSize, = self._HEADER.unpack_from(buffer, start)
+			if self._maxFrameSize < frameSize:
+				raise ValueError("Frame of %d bytes exceeds %d" % (frameSize, self._maxFrameSize))
+			frameEnd = start + headerSize + frameSize
+			if bufferSize < frameEnd:
+				break
+			frames.append(view[start + headerSize:frameEnd].tobytes())
+			start = frameEnd
+		return frames, start
+
+	def frame(self, payload):
+		return self._HEADER.pack(len(payload)) + payload
+
+
+if __name__ == "__main__":
+	import doctest
+	print doctest.testmod()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""
+Remote name requests page each device individually and are far slower than
+the inquiry itself, so they are done here, off to the side, and the names
+trickle in after the addresses are already known.
+"""
+
+from __future__ import with_statement
+
+import heapq
+import itertools
+import threading
+import logging
+
+import gobject
+
+import util.misc as misc_utils
+import util.go_utils as gobject_utils
+
+
+_moduleLogger = logging.getLogger(__name__)
+
+
+class NameResolver(gobject.GObject):
+
+	__gsignals__ = {
+		'name_resolved' : (
+			gobject.SIGNAL_RUN_LAST,
+			gobject.TYPE_NONE,
+			(gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT),
+		),
+	}
+
+	PRIORITY_NEW = 0
+	PRIORITY_RETRY = 1
+	PRIORITY_REFRESH = 2
+
+	def __init__(self, backend, timeout = 10, maxAttempts = 3):
+		gobject.GObject.__init__(self)
+		self._backend = backend
+		self._timeout = timeout
+		self._maxAttempts = maxAttempts
+
+		self._condition = threading.Condition()
+		self._queue = []
+		self._queued = {}
+		self._attempts = {}
+		self._counter = itertools.count()
+
+		# Each run gets its own stop event, a thread from a previous run that
+		# is still stuck in a lookup then never touches the queue again
+		# rather than sharing it with the thread of the current run
+		self._stopped = None
+
+	def start(self):
+		assert self._stopped is None
+		self._stopped = threading.Event()
+		thread = threading.Thread(
+			name = type(self).__name__,
+			target = self._consume_queue,
+			args = (self._stopped, ),
+		)
+		thread.setDaemon(True)
+		thread.start()
+
+	def stop(self):
+		if self._stopped is None:
+			return
+		with self._condition:
+			self._stopped.set()
+			self._stopped = None
+			del self._queue[:]
+			self._queued.clear()
+			self._attempts.clear()
+			self._condition.notifyAll()
+
+	def request(self, address, priority = PRIORITY_NEW):
+		"""
+		Queue up a name lookup, a request for an already queued address only
+		ever raises its priority
+		"""
+		with self._condition:
+			queuedPriority = self._queued.get(address, None)
+			if queuedPriority is not None and queuedPriority <= priority:
+				return
+			self._push(address, priority)
+			self._condition.notify()
+
+	def _push(self, address, priority):
+		# Stale entries are left in the heap and skipped when popped
+		self._queued[address] = priority
+		heapq.heappush(self._queue, (priority, self._counter.next(), address))
+
+	def _pop(self, stopped):
+		with self._condition:
+			while not stopped.isSet():
+				while self._queue:
+					priority, _, address = heapq.heappop(self._queue)
+					if self._queued.get(address, None) == priority:
+						del self._queued[address]
+						return address
+				self._condition.wait()
+			return None
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _consume_queue(self, stopped):
+		while True:
+			address = self._pop(stopped)
+			if address is None:
+				break
+
+			try:
+				name = self._backend.lookup_name(address, self._timeout)
+			except Exception:
+				_moduleLogger.exception("Name lookup failed for %r" % (address, ))
+				name = None
+
+			with self._condition:
+				if stopped.isSet():
+					break
+				if name is None:
+					attempts = self._attempts.get(address, 0) + 1
+					if attempts < self._maxAttempts:
+						self._attempts[address] = attempts
+						self._push(address, self.PRIORITY_RETRY)
+					else:
+						_moduleLogger.info("Giving up on name for %r after %d attempts" % (address, attempts))
+						self._attempts.pop(address, None)
+					continue
+				self._attempts.pop(address, None)
+
+			self._on_name_resolved(address, name)
+
+	@gobject_utils.async
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_name_resolved(self, address, name):
+		self.emit("name_resolved", address, name)
+
+
+gobject.type_register(NameResolver)
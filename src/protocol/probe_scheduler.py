@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+"""
+Keeps presence fresh for the devices we already know about by paging each
+one directly (a remote name request) rather than inquiring the whole
+neighbourhood.  A page to a device that is around answers in well under a
+second, an inquiry takes ten.
+"""
+
+import Queue
+import functools
+import itertools
+import collections
+import logging
+
+import gobject
+
+import util.misc as misc_utils
+import util.go_utils as gobject_utils
+
+
+_moduleLogger = logging.getLogger(__name__)
+
+
+class ProbeScheduler(gobject.GObject):
+	"""
+	Devices answering are probed every interval, ones that don't back off
+	exponentially up to maxInterval so absent devices don't hog the radio.
+
+	The waiting is done with main loop timers and the probes themselves are
+	background tasks on the session's AsyncPool, at most maxInFlight of them
+	at once so they never crowd an inquiry out of the pool's queue.
+	"""
+
+	__gsignals__ = {
+		'probed' : (
+			gobject.SIGNAL_RUN_LAST,
+			gobject.TYPE_NONE,
+			(gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT),
+		),
+	}
+
+	def __init__(self, backend, asyncPool, interval = 60, maxInterval = 30 * 60, timeout = 2, maxInFlight = 2):
+		"""
+		@param timeout Seconds to page a device for, devices that are around
+			answer far quicker than this
+		"""
+		gobject.GObject.__init__(self)
+		self._backend = backend
+		self._asyncPool = asyncPool
+		self._interval = interval
+		self._maxInterval = maxInterval
+		self._timeout = timeout
+		self._maxInFlight = maxInFlight
+
+		# address -> current interval between probes
+		self._intervals = {}
+		# address -> token, new on every add() so results of probes started
+		# before a device was removed and re-added can be told apart
+		self._tokens = {}
+		self._nextToken = itertools.count()
+		# address -> main loop timer waiting for it to be due
+		self._timers = {}
+		# (address, token) due, waiting on being resumed or on a probe finishing
+		self._ready = collections.deque()
+		# tokens of the probes running on the pool
+		self._inFlight = set()
+
+		self._isRunning = False
+		self._isPaused = False
+
+	def start(self):
+		self._isRunning = True
+
+	def stop(self):
+		self._isRunning = False
+		for timerId in self._timers.itervalues():
+			gobject.source_remove(timerId)
+		self._timers.clear()
+		self._intervals.clear()
+		self._tokens.clear()
+		self._ready.clear()
+		# Their results are ignored once they trickle in
+		self._inFlight.clear()
+
+	def pause(self):
+		"""
+		Hold off probing, like while an inquiry has the radio busy
+		"""
+		self._isPaused = True
+
+	def resume(self):
+		self._isPaused = False
+		self._submit_ready()
+
+	def add(self, address):
+		"""
+		Start probing a device, first after one interval since it was just seen
+		"""
+		if address in self._intervals:
+			return
+		self._intervals[address] = self._interval
+		self._tokens[address] = self._nextToken.next()
+		self._schedule(address, self._interval)
+
+	def remove(self, address):
+		self._intervals.pop(address, None)
+		self._tokens.pop(address, None)
+		timerId = self._timers.pop(address, None)
+		if timerId is not None:
+			gobject.source_remove(timerId)
+		# Anything left in _ready or _inFlight carries the old token and is
+		# dropped when it comes up
+
+	def _is_current(self, address, token):
+		return self._tokens.get(address, None) == token
+
+	def _schedule(self, address, interval):
+		token = self._tokens[address]
+		self._timers[address] = gobject_utils.timeout_add_seconds(
+			interval,
+			functools.partial(self._on_due, address, token),
+		)
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_due(self, address, token):
+		if self._is_current(address, token):
+			self._timers.pop(address, None)
+			self._ready.append((address, token))
+			self._submit_ready()
+		return False
+
+	def _submit_ready(self):
+		while (
+			self._isRunning and not self._isPaused and
+			self._ready and len(self._inFlight) < self._maxInFlight
+		):
+			address, token = self._ready.popleft()
+			if not self._is_current(address, token):
+				continue
+			try:
+				self._asyncPool.add_task(
+					self._backend.lookup_name,
+					(address, self._timeout),
+					{},
+					functools.partial(self._on_probed, address, token),
+					functools.partial(self._on_probe_failed, address, token),
+					priority = gobject_utils.AsyncPool.PRIORITY_BACKGROUND,
+					# Don't page a device we're already busy with
+					key = address,
+				)
+			except Queue.Full:
+				# Backed up, try again next interval without counting it
+				# against the device
+				self._schedule(address, self._intervals[address])
+				continue
+			self._inFlight.add(token)
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_probed(self, address, token, name):
+		if token not in self._inFlight:
+			# Stopped since
+			return
+		self._inFlight.discard(token)
+
+		isCurrent = self._is_current(address, token)
+		if isCurrent:
+			interval = self._intervals[address]
+			if name is None:
+				interval = min(interval * 2, self._maxInterval)
+			else:
+				interval = self._interval
+			self._intervals[address] = interval
+			self._schedule(address, interval)
+		# else removed, and maybe re-added with its own timer, since
+
+		self._submit_ready()
+		if isCurrent:
+			self.emit("probed", address, name)
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_probe_failed(self, address, token, error):
+		if token in self._inFlight:
+			_moduleLogger.error("Probe failed for %r: %s" % (address, error))
+		self._on_probed(address, token, None)
+
+
+gobject.type_register(ProbeScheduler)
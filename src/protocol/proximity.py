@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""
+How close devices are, going by the signal strength (RSSI) inquiries report
+them at.  Single readings swing by 10 dBm or more, so each device keeps a
+short history and the estimates are smoothed over it.
+"""
+
+from __future__ import with_statement
+
+import array
+import threading
+
+
+BAND_NEAR = "near"
+BAND_MID = "mid"
+BAND_FAR = "far"
+# Never reported a signal strength, like with adapters doing standard inquiries
+BAND_UNKNOWN = "unknown"
+
+
+class _RssiHistory(object):
+	"""
+	Fixed size ring buffer of RSSI samples, dBm fitting in a signed char
+	"""
+
+	__slots__ = ("samples", "nextIndex", "count")
+
+	def __init__(self, size):
+		self.samples = array.array("b", [0]) * size
+		self.nextIndex = 0
+		self.count = 0
+
+	def append(self, rssi):
+		self.samples[self.nextIndex] = max(-128, min(127, rssi))
+		self.nextIndex = (self.nextIndex + 1) % len(self.samples)
+		self.count = min(self.count + 1, len(self.samples))
+
+	def chronological(self):
+		if self.count < len(self.samples):
+			return self.samples[:self.count]
+		return self.samples[self.nextIndex:] + self.samples[:self.nextIndex]
+
+
+class ProximityTracker(object):
+	"""
+	Samples come from the inquiry threads while the estimates are read from
+	the main loop, so everything is locked.  Estimates are only recomputed,
+	all dirty devices at once, when one is asked for.
+
+	>>> tracker = ProximityTracker(historySize=4)
+	>>> tracker.record_batch([("a", -50), ("a", -52), ("b", -70), ("a", -90), ("c", -95)])
+	>>> tracker.get_band("a"), tracker.get_band("b"), tracker.get_band("c"), tracker.get_band("d")
+	('near', 'mid', 'far', 'unknown')
+	>>> ewma, median = tracker.get_estimate("a")
+	>>> median, round(ewma, 1)
+	(-52, -62.4)
+	>>> tracker.record_batch([("a", -40), ("a", -41), ("a", -42)])
+	>>> tracker.get_estimate("a")[1]
+	-41
+	>>> tracker.forget("a")
+	>>> tracker.get_band("a")
+	'unknown'
+	"""
+
+	def __init__(self, historySize = 8, alpha = 0.3, nearThreshold = -60, farThreshold = -80):
+		"""
+		@param alpha Weight of each new sample in the moving average
+		@param nearThreshold Median RSSI (dBm) at or above which a device is near
+		@param farThreshold Median RSSI (dBm) below which a device is far
+		"""
+		self._historySize = historySize
+		self._alpha = alpha
+		self._nearThreshold = nearThreshold
+		self._farThreshold = farThreshold
+		self._lock = threading.Lock()
+
+		# address -> _RssiHistory
+		self._histories = {}
+		# address -> (ewma, median)
+		self._estimates = {}
+		self._dirty = set()
+
+	def record(self, address, rssi):
+		self.record_batch(((address, rssi), ))
+
+	def record_batch(self, samples):
+		"""
+		@param samples [(address, rssi)]
+		"""
+		with self._lock:
+			for address, rssi in samples:
+				history = self._histories.get(address, None)
+				if history is None:
+					history = _RssiHistory(self._historySize)
+					self._histories[address] = history
+				history.append(rssi)
+				self._dirty.add(address)
+
+	def forget(self, address):
+		with self._lock:
+			self._histories.pop(address, None)
+			self._estimates.pop(address, None)
+			self._dirty.discard(address)
+
+	def get_estimate(self, address):
+		"""
+		@returns (ewma, median) RSSI or None if there are no samples
+		"""
+		with self._lock:
+			if self._dirty:
+				self._refresh_estimates()
+			return self._estimates.get(address, None)
+
+	def get_band(self, address):
+		estimate = self.get_estimate(address)
+		if estimate is None:
+			return BAND_UNKNOWN
+		# The median shrugs off the odd reflection or body blocking a reading
+		_, median = estimate
+		if self._nearThreshold <= median:
+			return BAND_NEAR
+		elif self._farThreshold <= median:
+			return BAND_MID
+		else:
+			return BAND_FAR
+
+	def _refresh_estimates(self):
+		alpha = self._alpha
+		for address in self._dirty:
+			samples = self._histories[address].chronological()
+			ewma = float(samples[0])
+			for rssi in samples[1:]:
+				ewma += alpha * (rssi - ewma)
+			median = sorted(samples)[len(samples) // 2]
+			self._estimates[address] = ewma, median
+		self._dirty.clear()
+
+
+if __name__ == "__main__":
+	import doctest
+	print doctest.testmod()
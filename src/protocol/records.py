@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""
+Compact, immutable records for the (potentially large) device tables.  Tuple
+subclasses with empty __slots__ so there is no per-instance dict and
+equality is a plain tuple compare.
+"""
+
+import binascii
+
+
+def pack_address(address):
+	"""
+	>>> pack_address("00:11:22:aa:BB:cc")
+	'\\x00\\x11"\\xaa\\xbb\\xcc'
+	>>> pack_address("00:11:22")
+	Traceback (most recent call last):
+	...
+	ValueError: Invalid bluetooth address: '00:11:22'
+	"""
+	try:
+		packed = binascii.unhexlify(address.replace(":", ""))
+	except TypeError:
+		packed = ""
+	if len(packed) != 6:
+		raise ValueError("Invalid bluetooth address: %r" % (address, ))
+	return packed
+
+
+def unpack_address(packed):
+	"""
+	>>> unpack_address(pack_address("00:11:22:aa:BB:cc"))
+	'00:11:22:AA:BB:CC'
+	"""
+	return ":".join("%02X" % ord(byte) for byte in packed)
+
+
+class BluetoothAddress(tuple):
+	"""
+	The 6-byte packed address along with its cached string form
+
+	>>> address = BluetoothAddress("00:11:22:aa:bb:cc")
+	>>> str(address)
+	'00:11:22:AA:BB:CC'
+	>>> address == BluetoothAddress("00:11:22:AA:BB:CC")
+	True
+	>>> address.packed == pack_address(str(address))
+	True
+	>>> address.packed = "foo"
+	Traceback (most recent call last):
+	...
+	AttributeError: can't set attribute
+	"""
+
+	__slots__ = ()
+
+	def __new__(cls, address):
+		if isinstance(address, cls):
+			return address
+		packed = pack_address(address)
+		return tuple.__new__(cls, (packed, unpack_address(packed)))
+
+	def __getnewargs__(self):
+		return (self[1], )
+
+	@property
+	def packed(self):
+		return self[0]
+
+	def __str__(self):
+		return self[1]
+
+	def __repr__(self):
+		return "BluetoothAddress(%r)" % (self[1], )
+
+
+class DeviceRecord(tuple):
+	"""
+	What the addressbook knows about a device
+
+	>>> record = DeviceRecord("00:11:22:aa:bb:cc", None, 0x5a020c)
+	>>> record.name is None, record.deviceClass == 0x5a020c
+	(True, True)
+	>>> named = record.replace(name="Phone")
+	>>> named == record, named.name, str(named.address)
+	(False, 'Phone', '00:11:22:AA:BB:CC')
+	>>> named == DeviceRecord("00:11:22:AA:BB:CC", "Phone", 0x5a020c)
+	True
+	"""
+
+	__slots__ = ()
+
+	def __new__(cls, address, name, deviceClass):
+		return tuple.__new__(cls, (BluetoothAddress(address), name, deviceClass))
+
+	def __getnewargs__(self):
+		return tuple(self)
+
+	@property
+	def address(self):
+		return self[0]
+
+	@property
+	def name(self):
+		return self[1]
+
+	@property
+	def deviceClass(self):
+		return self[2]
+
+	def replace(self, **kwds):
+		address = kwds.pop("address", self[0])
+		name = kwds.pop("name", self[1])
+		deviceClass = kwds.pop("deviceClass", self[2])
+		assert not kwds, "Unknown fields %r" % (kwds.keys(), )
+		return type(self)(address, name, deviceClass)
+
+	def __repr__(self):
+		return "DeviceRecord(address=%r, name=%r, deviceClass=%r)" % (str(self[0]), self[1], self[2])
+
+
+if __name__ == "__main__":
+	import doctest
+	print doctest.testmod()
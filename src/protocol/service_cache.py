@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""
+SDP browses cost seconds per device, so remember what each device offers
+"""
+
+from __future__ import with_statement
+
+import time
+import threading
+import logging
+
+
+_moduleLogger = logging.getLogger(__name__)
+
+
+class ServiceCache(object):
+	"""
+	LRU of SDP records keyed by (address, uuid), a uuid of None being a browse
+	of everything the device offers.  Lookups happen on the worker threads
+	while persisting happens on the main loop, so everything is locked.
+
+	Empty results are what an SDP browse of a device that is out of range
+	gives as well, so they are only trusted for negativeTtl and never
+	persisted.
+	"""
+
+	# Seconds
+	DEFAULT_TTL = 24 * 60 * 60
+	DEFAULT_NEGATIVE_TTL = 5 * 60
+
+	def __init__(self, maxEntries = 128, ttl = DEFAULT_TTL, negativeTtl = DEFAULT_NEGATIVE_TTL):
+		self._maxEntries = maxEntries
+		self._ttl = ttl
+		self._negativeTtl = negativeTtl
+		self._lock = threading.Lock()
+
+		# key -> [lastUsed, timestamp, records]
+		self._entries = {}
+		self._tick = 0
+
+		self.hits = 0
+		self.misses = 0
+		self.expirations = 0
+		self.evictions = 0
+
+	def get(self, address, uuid = None):
+		"""
+		@raises KeyError on a cache miss
+		"""
+		key = address, uuid
+		with self._lock:
+			try:
+				entry = self._entries[key]
+			except KeyError:
+				self.misses += 1
+				raise
+			if self._is_expired(entry[1], entry[2], time.time()):
+				del self._entries[key]
+				self.expirations += 1
+				self.misses += 1
+				raise KeyError(key)
+			self.hits += 1
+			entry[0] = self._next_tick()
+			return entry[2]
+
+	def set(self, address, uuid, records, timestamp = None):
+		if timestamp is None:
+			timestamp = time.time()
+		key = address, uuid
+		with self._lock:
+			self._entries[key] = [self._next_tick(), timestamp, records]
+			if self._maxEntries < len(self._entries):
+				# Linear, but only on insertion and the cache is small
+				lruKey = min(self._entries.iterkeys(), key=lambda k: self._entries[k][0])
+				del self._entries[lruKey]
+				self.evictions += 1
+
+	def invalidate(self, address):
+		with self._lock:
+			staleKeys = [key for key in self._entries.iterkeys() if key[0] == address]
+			for key in staleKeys:
+				del self._entries[key]
+		if staleKeys:
+			_moduleLogger.debug("Dropped %d cached service records for %r" % (len(staleKeys), address))
+
+	def export_records(self, address):
+		"""
+		@returns {uuid: (timestamp, records)} for persisting
+		"""
+		now = time.time()
+		with self._lock:
+			return dict(
+				(uuid, (timestamp, records))
+				for ((entryAddress, uuid), (_, timestamp, records)) in self._entries.iteritems()
+				if entryAddress == address and records and not self._is_expired(timestamp, records, now)
+			)
+
+	def import_records(self, address, records):
+		now = time.time()
+		for uuid, (timestamp, uuidRecords) in records.iteritems():
+			if not self._is_expired(timestamp, uuidRecords, now):
+				self.set(address, uuid, uuidRecords, timestamp)
+
+	def get_stats(self):
+		with self._lock:
+			return {
+				"entries": len(self._entries),
+				"hits": self.hits,
+				"misses": self.misses,
+				"expirations": self.expirations,
+				"evictions": self.evictions,
+			}
+
+	def _next_tick(self):
+		self._tick += 1
+		return self._tick
+
+	def _is_expired(self, timestamp, records, now):
+		ttl = self._ttl if records else self._negativeTtl
+		return ttl < now - timestamp
@@ -2,8 +2,11 @@
 
 import logging
 
-import backend
+import simulated_backend
 import addressbook
+import name_resolver
+import probe_scheduler
+import device_cache
 import state_machine
 
 import util.go_utils as gobject_utils
@@ -13,6 +16,50 @@ import util.misc as misc_utils
 _moduleLogger = logging.getLogger(__name__)
 
 
+def parse_backend_spec(spec):
+	"""
+	@param spec "bluez" or "simulated" optionally followed by
+		":key=value,..." options, see simulated_backend.parse_options
+	@returns (name, {option: value})
+	@raises ValueError For an unknown backend or option
+
+	>>> parse_backend_spec("bluez")
+	('bluez', {})
+	>>> parse_backend_spec("simulated:devices=3")
+	('simulated', {'deviceCount': 3})
+	>>> parse_backend_spec("bluez:devices=3")
+	Traceback (most recent call last):
+	...
+	ValueError: The bluez backend takes no options
+	>>> parse_backend_spec("hci0")
+	Traceback (most recent call last):
+	...
+	ValueError: Unknown backend 'hci0'
+	"""
+	name, _, options = spec.partition(":")
+	if name == "bluez":
+		if options:
+			raise ValueError("The bluez backend takes no options")
+		return name, {}
+	elif name == "simulated":
+		return name, simulated_backend.parse_options(options)
+	else:
+		raise ValueError("Unknown backend %r" % (spec, ))
+
+
+def create_backend(spec):
+	"""
+	@param spec See parse_backend_spec
+	"""
+	name, options = parse_backend_spec(spec)
+	if name == "bluez":
+		# Imported here so only the real stack needs PyBluez installed
+		import bluez_backend
+		return bluez_backend.BluetoothBackend()
+	else:
+		return simulated_backend.SimulatedBackend(**options)
+
+
 class Session(object):
 
 	_DEFAULTS = {
@@ -21,7 +68,25 @@ class Session(object):
 
 	_MINIMUM_MESSAGE_PERIOD = state_machine.to_seconds(minutes=30)
 
-	def __init__(self, defaults = None):
+	# Bounds for adapting the contacts period to how much the neighbourhood
+	# is changing, the configured period being the upper bound
+	_MIN_CONTACTS_PERIOD = state_machine.to_seconds(minutes=1)
+	_INIT_CONTACTS_PERIOD = state_machine.to_seconds(minutes=5)
+
+	# Enough that an inquiry doesn't hold up connects and SDP lookups
+	_WORKER_COUNT = 3
+	_MAX_QUEUE_DEPTH = 32
+
+	# Inquiries regularly miss devices that are around, so give them a second
+	# chance before dropping them from the contact lists
+	_ABSENT_SCANS_BEFORE_REMOVAL = 2
+
+	def __init__(self, defaults = None, cachePath = None, backendSpec = "bluez"):
+		"""
+		@param cachePath Where to remember devices between sessions, None to
+			not persist them
+		@param backendSpec See create_backend
+		"""
 		if defaults is None:
 			defaults = self._DEFAULTS
 		else:
@@ -31,8 +96,11 @@ class Session(object):
 				elif quant < 0:
 					defaults[key] = (state_machine.UpdateStateMachine.INFINITE_PERIOD, unit)
 
-		self._asyncPool = gobject_utils.AsyncPool()
-		self._backend = backend.BluetoothBackend()
+		self._asyncPool = gobject_utils.AsyncPool(
+			workerCount = self._WORKER_COUNT,
+			maxQueueDepth = self._MAX_QUEUE_DEPTH,
+		)
+		self._backend = create_backend(backendSpec)
 
 		if defaults["contacts"][0] == state_machine.UpdateStateMachine.INFINITE_PERIOD:
 			contactsPeriodInSeconds = state_machine.UpdateStateMachine.INFINITE_PERIOD
@@ -40,7 +108,14 @@ class Session(object):
 			contactsPeriodInSeconds = state_machine.to_seconds(
 				**{defaults["contacts"][1]: defaults["contacts"][0],}
 			)
-		self._addressbook = addressbook.Addressbook(self._backend, self._asyncPool)
+		self._nameResolver = name_resolver.NameResolver(self._backend)
+		self._prober = probe_scheduler.ProbeScheduler(self._backend, self._asyncPool)
+		self._deviceCache = device_cache.DeviceCache(cachePath)
+		self._addressbook = addressbook.Addressbook(
+			self._backend, self._asyncPool, self._nameResolver, self._deviceCache,
+			absenceThreshold = self._ABSENT_SCANS_BEFORE_REMOVAL,
+			prober = self._prober,
+		)
 		self._addressbookStateMachine = state_machine.UpdateStateMachine([self.addressbook], "Addressbook")
 		self._addressbookStateMachine.set_state_strategy(
 			state_machine.StateMachine.STATE_DND,
@@ -50,14 +125,28 @@ class Session(object):
 			state_machine.StateMachine.STATE_IDLE,
 			state_machine.NopStateStrategy()
 		)
+		if contactsPeriodInSeconds == state_machine.UpdateStateMachine.INFINITE_PERIOD:
+			self._contactsStrategy = None
+			activeStrategy = state_machine.ConstantStateStrategy(contactsPeriodInSeconds)
+		else:
+			maxPeriod = max(contactsPeriodInSeconds, self._MIN_CONTACTS_PERIOD)
+			self._contactsStrategy = state_machine.AdaptiveStateStrategy(
+				init = min(self._INIT_CONTACTS_PERIOD, maxPeriod),
+				min = self._MIN_CONTACTS_PERIOD,
+				max = maxPeriod,
+			)
+			activeStrategy = self._contactsStrategy
 		self._addressbookStateMachine.set_state_strategy(
 			state_machine.StateMachine.STATE_ACTIVE,
-			state_machine.ConstantStateStrategy(contactsPeriodInSeconds)
+			activeStrategy,
 		)
+		self._addressbook.connect("update_complete", self._on_addressbook_updated)
 
 		self._masterStateMachine = state_machine.MasterStateMachine()
 		self._masterStateMachine.append_machine(self._addressbookStateMachine)
 
+		self._loginExecution = None
+
 		self._lastDndCheck = 0
 		self._cachedIsDnd = False
 
@@ -65,9 +154,16 @@ class Session(object):
 		self._masterStateMachine.close()
 
 	def login(self, on_success, on_error):
+		# Before anything else so the contact lists created on login start out
+		# populated
+		self._addressbook.load_cache()
+
 		self._asyncPool.start()
+		self._nameResolver.start()
+		self._prober.start()
 
 		le = gobject_utils.AsyncLinearExecution(self._asyncPool, self._login)
+		self._loginExecution = le
 		le.start(on_success, on_error)
 
 	@misc_utils.log_exception(_moduleLogger)
@@ -78,6 +174,9 @@ class Session(object):
 				(),
 				{},
 			)
+		except gobject_utils.CancelledError:
+			_moduleLogger.info("Login cancelled")
+			return
 		except Exception, e:
 			on_error(e)
 			return
@@ -86,9 +185,28 @@ class Session(object):
 		on_success(isLoggedIn)
 
 	def logout(self):
+		# Cancel first so blocking calls get interrupted rather than the pool
+		# waiting on them
+		loginExecution, self._loginExecution = self._loginExecution, None
+		if loginExecution is not None:
+			loginExecution.cancel()
+		self._addressbook.cancel()
 		self._asyncPool.stop()
+		self._nameResolver.stop()
+		self._prober.stop()
 		self._masterStateMachine.stop()
 		self._backend.logout()
+		self._addressbook.save_cache()
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _on_addressbook_updated(self, addressbook, stats):
+		if self._contactsStrategy is None:
+			return
+		isSooner = self._contactsStrategy.record_update(stats["changes"])
+		isActive = self._addressbookStateMachine.state == state_machine.StateMachine.STATE_ACTIVE
+		if isSooner and isActive:
+			# The next poll was scheduled with the old, longer, period
+			self._addressbookStateMachine.reset_timers()
 
 	def is_logged_in(self):
 		return self._backend.is_logged_in()
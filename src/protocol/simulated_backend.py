@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+
+"""
+An in-process stand in for the bluetooth stack, so everything above the
+backend can be load and latency tested without radios.  The devices and
+their attributes come from a seeded random.Random so runs repeat, and every
+delay the real stack has is a knob.
+"""
+
+from __future__ import with_statement
+
+import time
+import errno
+import random
+import socket
+import threading
+import logging
+
+import gobject
+
+import util.misc as misc_utils
+import util.go_utils as gobject_utils
+
+import backend
+
+
+_moduleLogger = logging.getLogger(__name__)
+
+
+_DEVICE_CLASSES = (
+	0x5a020c, # Smart phone
+	0x7a020c, # Smart phone
+	0x3e010c, # Laptop
+	0x240404, # Headset
+	0x200408, # Hands free
+	0x000540, # Keyboard
+)
+
+
+_SERVICES = {
+	# Phones
+	0x02: (
+		("Dial-up Networking", "1103", 1),
+		("OBEX Object Push", "1105", 9),
+		("Handsfree Gateway", "111F", 3),
+	),
+	# Computers
+	0x01: (
+		("OBEX Object Push", "1105", 9),
+		("Serial Port", "1101", 2),
+	),
+	# Audio
+	0x04: (
+		("Headset", "1108", 2),
+		("Handsfree", "111E", 1),
+	),
+	# Peripherals
+	0x05: (
+		("Human Interface Device", "1124", 17),
+	),
+}
+
+
+class SimulatedDevice(object):
+
+	__slots__ = ("address", "deviceClass", "name", "services", "uuids", "rssi")
+
+	def __init__(self, address, deviceClass, name, services, rssi):
+		"""
+		@param rssi The signal strength the device is typically seen at
+		"""
+		self.address = address
+		self.deviceClass = deviceClass
+		self.name = name
+		self.services = services
+		self.rssi = rssi
+		self.uuids = [service["service-classes"][0] for service in services]
+
+
+def create_devices(count, seed = 0):
+	"""
+	>>> devices = create_devices(3)
+	>>> [device.address for device in devices]
+	['00:00:00:00:00:00', '00:00:00:00:00:01', '00:00:00:00:00:02']
+	>>> [device.name for device in devices] == [device.name for device in create_devices(3)]
+	True
+	"""
+	rand = random.Random(seed)
+	devices = []
+	for index in xrange(count):
+		address = ":".join("%02X" % ((index >> shift) & 0xFF) for shift in (40, 32, 24, 16, 8, 0))
+		deviceClass = rand.choice(_DEVICE_CLASSES)
+		name = "Simulated %d" % (index, )
+		services = [
+			{
+				"host": address,
+				"name": serviceName,
+				"description": None,
+				"provider": None,
+				"protocol": "RFCOMM" if port < 10 else "L2CAP",
+				"port": port,
+				"service-classes": [uuid],
+				"profiles": [(uuid, 0x0100)],
+				"service-id": None,
+			}
+			for (serviceName, uuid, port) in _SERVICES.get((deviceClass >> 8) & 0x1F, ())
+		]
+		rssi = rand.randint(-95, -40)
+		devices.append(SimulatedDevice(address, deviceClass, name, services, rssi))
+	return devices
+
+
+_OPTIONS = {
+	"devices": ("deviceCount", int),
+	"inquiry-latency": ("inquiryLatency", float),
+	"name-delay": ("nameDelay", float),
+	"sdp-delay": ("sdpDelay", float),
+	"connect-delay": ("connectDelay", float),
+	"throughput": ("throughput", int),
+	"presence": ("presence", float),
+	"seed": ("seed", int),
+}
+
+
+def parse_options(options):
+	"""
+	>>> sorted(parse_options("devices=100,inquiry-latency=0.5").iteritems())
+	[('deviceCount', 100), ('inquiryLatency', 0.5)]
+	>>> parse_options("")
+	{}
+	>>> parse_options("color=blue")
+	Traceback (most recent call last):
+	...
+	ValueError: Unknown simulated backend option 'color'
+	>>> parse_options("devices=lots")
+	Traceback (most recent call last):
+	...
+	ValueError: Bad value 'lots' for simulated backend option 'devices'
+	"""
+	kwds = {}
+	for option in options.split(","):
+		if not option:
+			continue
+		key, _, value = option.partition("=")
+		try:
+			name, convert = _OPTIONS[key.strip()]
+		except KeyError:
+			raise ValueError("Unknown simulated backend option %r" % (key, ))
+		try:
+			kwds[name] = convert(value.strip())
+		except ValueError:
+			raise ValueError("Bad value %r for simulated backend option %r" % (value, key))
+	return kwds
+
+
+class _SimulatedPeer(object):
+	"""
+	The device's end of a connection, echoing back whatever it is sent no
+	faster than the link's throughput
+	"""
+
+	_READ_SIZE = 4096
+
+	def __init__(self, sock, throughput):
+		self._socket = sock
+		self._throughput = throughput
+
+	def start(self):
+		thread = threading.Thread(name = "SimulatedPeer", target = self._echo)
+		thread.setDaemon(True)
+		thread.start()
+
+	@misc_utils.log_exception(_moduleLogger)
+	def _echo(self):
+		try:
+			while True:
+				data = self._socket.recv(self._READ_SIZE)
+				if not data:
+					break
+				if self._throughput:
+					time.sleep(len(data) / float(self._throughput))
+				self._socket.sendall(data)
+		except socket.error:
+			pass
+		finally:
+			self._socket.close()
+
+
+class SimulatedBackend(backend.Backend):
+
+	def __init__(
+		self,
+		deviceCount = 10,
+		inquiryLatency = 1.0,
+		nameDelay = 0.1,
+		sdpDelay = 0.2,
+		connectDelay = 0.05,
+		throughput = None,
+		presence = 1.0,
+		seed = 0,
+	):
+		"""
+		@param inquiryLatency Seconds for an inquiry to find every device,
+			spread evenly between them
+		@param throughput Bytes per second each connection carries, None for as
+			fast as the host can go
+		@param presence Chance of a device showing up in any one inquiry or
+			answering any one page
+
+		Each inquiry and each page draws from its own random.Random, seeded
+		from (seed, what, attempt), so runs repeat however the threads making
+		the calls get scheduled.
+		"""
+		backend.Backend.__init__(self)
+		self._devices = create_devices(deviceCount, seed)
+		self._devicesByAddress = dict((device.address, device) for device in self._devices)
+		self._inquiryLatency = inquiryLatency
+		self._nameDelay = nameDelay
+		self._sdpDelay = sdpDelay
+		self._connectDelay = connectDelay
+		self._throughput = throughput
+		self._presence = presence
+		self._seed = seed
+		self._isLoggedIn = False
+
+		self._attemptsLock = threading.Lock()
+		self._inquiryCount = 0
+		# address -> pages so far
+		self._pageCounts = {}
+
+	@property
+	def devices(self):
+		return self._devices
+
+	def login(self):
+		self._isLoggedIn = True
+		self.emit("login")
+
+	def logout(self):
+		self._isLoggedIn = False
+		self._connectionPool.close()
+		self.emit("logout")
+
+	def is_logged_in(self):
+		return self._isLoggedIn
+
+	def enable_listening(self, enable):
+		self._isListening = enable
+
+	def get_contacts(self, streaming=False, cancellation=None):
+		with self._attemptsLock:
+			self._inquiryCount += 1
+			rand = self._create_random("inquiry", self._inquiryCount)
+		if self._presence < 1.0:
+			visible = [device for device in self._devices if rand.random() < self._presence]
+		else:
+			visible = self._devices
+		interval = self._inquiryLatency / max(len(visible), 1)
+
+		cancelled = threading.Event()
+		if cancellation is not None:
+			cancellation.register(cancelled.set)
+		try:
+			found = []
+			rssiSamples = []
+			deadline = time.time()
+			for device in visible:
+				deadline += interval
+				remaining = deadline - time.time()
+				if 0 < remaining:
+					cancelled.wait(remaining)
+				if cancelled.isSet():
+					raise gobject_utils.CancelledError("Inquiry cancelled")
+				# Like the real inquiries, names are left to the name resolver
+				contact = device.address, device.deviceClass, None
+				found.append(contact)
+				self._advertisedServices[device.address] = device.uuids
+				rssiSamples.append((device.address, int(rand.gauss(device.rssi, 4))))
+				if streaming:
+					self._on_device_discovered(*contact)
+		finally:
+			if cancellation is not None:
+				cancellation.unregister(cancelled.set)
+		self._proximity.record_batch(rssiSamples)
+		return found
+
+	def _lookup_name(self, address, timeout):
+		time.sleep(min(self._nameDelay, timeout))
+		device = self._devicesByAddress.get(address, None)
+		if device is None or timeout < self._nameDelay:
+			return None
+		if self._presence < 1.0:
+			with self._attemptsLock:
+				page = self._pageCounts.get(address, 0) + 1
+				self._pageCounts[address] = page
+			if self._presence <= self._create_random("page", address, page).random():
+				# Out of range for this page
+				return None
+		return device.name
+
+	def get_contact_services(self, address, uuid = None):
+		try:
+			services = self._serviceCache.get(address, uuid)
+		except KeyError:
+			time.sleep(self._sdpDelay)
+			device = self._devicesByAddress.get(address, None)
+			if device is None:
+				services = []
+			else:
+				services = [
+					service
+					for service in device.services
+					if uuid is None or uuid in service["service-classes"]
+				]
+			self._serviceCache.set(address, uuid, services)
+		return services
+
+	def connect_device(self, addr, transport, port, cancellation=None):
+		poolKey = addr, port, transport
+		connection = self._connectionPool.checkout(poolKey)
+		if connection is not None:
+			return connection
+
+		cancelled = threading.Event()
+		if cancellation is not None:
+			cancellation.register(cancelled.set)
+		try:
+			cancelled.wait(self._connectDelay)
+		finally:
+			if cancellation is not None:
+				cancellation.unregister(cancelled.set)
+		if cancelled.isSet():
+			raise gobject_utils.CancelledError("Connect to %s cancelled" % (addr, ))
+		return self._open_connection(addr, poolKey)
+
+	def connect_device_async(self, addr, transport, port, on_success, on_error, cancellation=None):
+		poolKey = addr, port, transport
+		connection = self._connectionPool.checkout(poolKey)
+		if connection is not None:
+			gobject_utils.async(on_success)(connection)
+			return
+
+		timeoutId = []
+
+		@misc_utils.log_exception(_moduleLogger)
+		def on_connected():
+			timeoutId[:] = []
+			if cancellation is not None:
+				cancellation.unregister(on_cancelled)
+			try:
+				connection = self._open_connection(addr, poolKey)
+			except socket.error, e:
+				on_error(e)
+			else:
+				on_success(connection)
+			return False
+
+		def on_cancelled():
+			if not timeoutId:
+				return
+			gobject.source_remove(timeoutId.pop())
+			error = gobject_utils.CancelledError("Connect to %s cancelled" % (addr, ))
+			gobject_utils.async(on_error)(error)
+
+		if cancellation is not None:
+			cancellation.register(on_cancelled)
+		timeoutId.append(gobject.timeout_add(int(self._connectDelay * 1000), on_connected))
+
+	def _create_random(self, *purpose):
+		return random.Random(hash((self._seed, ) + purpose))
+
+	def _open_connection(self, addr, poolKey):
+		if addr not in self._devicesByAddress:
+			raise socket.error(errno.EHOSTDOWN, "Host is down")
+		local, remote = socket.socketpair()
+		_SimulatedPeer(remote, self._throughput).start()
+		return self._create_connection(local, addr, "", poolKey)
+
+
+gobject.type_register(SimulatedBackend)
+
+
+if __name__ == "__main__":
+	import doctest
+	print doctest.testmod()
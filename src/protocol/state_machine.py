@@ -165,6 +165,67 @@ class GeometricStateStrategy(object):
 		)
 
 
+class AdaptiveStateStrategy(object):
+	"""
+	Polls faster while updates keep finding changes and backs off while they
+	don't, fed with the outcome of each update through record_update
+	"""
+
+	def __init__(self, init, min, max, churnThreshold = 1, factor = 2):
+		assert 0 < min and min <= init and init <= max
+		assert 1 < factor
+		self._init = init
+		self._min = min
+		self._max = max
+		self._churnThreshold = churnThreshold
+		self._factor = factor
+		self._current = init
+
+		self.updateCount = 0
+		self.churnCount = 0
+		self.quietCount = 0
+		self.lastChangeCount = 0
+
+	def initialize_state(self):
+		self._current = self._init
+
+	def reinitialize_state(self):
+		pass
+
+	def increment_state(self):
+		pass
+
+	def record_update(self, changeCount):
+		"""
+		@returns True if the period got shorter, meaning whatever is scheduled
+			is now too far off
+		"""
+		self.updateCount += 1
+		self.lastChangeCount = changeCount
+		previous = self._current
+		if self._churnThreshold <= changeCount:
+			self.churnCount += 1
+			self._current = max(self._min, self._current // self._factor)
+		else:
+			self.quietCount += 1
+			self._current = min(self._max, self._current * self._factor)
+		return self._current < previous
+
+	@property
+	def timeout(self):
+		return self._current
+
+	def __str__(self):
+		return "AdaptiveStateStrategy(timeout=%r, updates=%r, churned=%r, quiet=%r, lastChanges=%r)" % (
+			self.timeout, self.updateCount, self.churnCount, self.quietCount, self.lastChangeCount,
+		)
+
+	def __repr__(self):
+		return "AdaptiveStateStrategy(init=%r, min=%r, max=%r, churnThreshold=%r, factor=%r)" % (
+			self._init, self._min, self._max, self._churnThreshold, self._factor,
+		)
+
+
 class StateMachine(object):
 
 	STATE_ACTIVE = 0, "active"
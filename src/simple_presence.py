@@ -1,3 +1,4 @@
+import itertools
 import logging
 
 import telepathy
@@ -6,6 +7,7 @@ import util.misc as misc_utils
 import tp
 import handle
 import protocol.state_machine as state_machine
+import protocol.proximity as proximity
 
 
 _moduleLogger = logging.getLogger(__name__)
@@ -19,6 +21,15 @@ class BluewirePresence(object):
 	HIDDEN = 'hidden'
 	OFFLINE = 'offline'
 
+	PROXIMITY_TO_PRESENCE = {
+		proximity.BAND_NEAR: ONLINE,
+		proximity.BAND_MID: ONLINE,
+		proximity.BAND_FAR: AWAY,
+		# Adapters doing standard inquiries don't report signal strength,
+		# being found at all has to do
+		proximity.BAND_UNKNOWN: ONLINE,
+	}
+
 	TO_PRESENCE_TYPE = {
 		ONLINE: telepathy.constants.CONNECTION_PRESENCE_TYPE_AVAILABLE,
 		AWAY: telepathy.constants.CONNECTION_PRESENCE_TYPE_AWAY,
@@ -66,12 +77,39 @@ class BluewirePresence(object):
 						raise telepathy.errors.InvalidArgument("Unsupported state on the state machine: %s" % state)
 				presenceType = BluewirePresence.TO_PRESENCE_TYPE[presence]
 			else:
-				presence = BluewirePresence.ONLINE
+				addressbook = self.session.addressbook
+				if not addressbook.has_contact(h.address):
+					presence = BluewirePresence.OFFLINE
+				elif not addressbook.is_contact_reachable(h.address):
+					# Known, but it didn't answer when last paged
+					presence = BluewirePresence.AWAY
+				else:
+					band = addressbook.get_contact_proximity(h.address)
+					presence = BluewirePresence.PROXIMITY_TO_PRESENCE[band]
 				presenceType = BluewirePresence.TO_PRESENCE_TYPE[presence]
 
 			presences[h] = (presenceType, presence)
 		return presences
 
+	def get_contact_presences(self, addresses):
+		"""
+		Like get_presences but only for the contacts with live handles, a
+		client can't be following a contact it holds no handle to
+
+		@return {ContactHandle: (Status, Presence Type)}
+		"""
+		handleIds = [
+			h.get_id()
+			for h in (
+				self._handles_by_name.get((telepathy.HANDLE_TYPE_CONTACT, address), None)
+				for address in addresses
+			)
+			if h is not None
+		]
+		if not handleIds:
+			return {}
+		return self.get_presences(handleIds)
+
 	def set_presence(self, status):
 		if status == self.OFFLINE:
 			self.Disconnect()
@@ -107,17 +145,14 @@ class SimplePresenceMixin(tp.ConnectionInterfaceSimplePresence, BluewirePresence
 			tp.CONNECTION_INTERFACE_SIMPLE_PRESENCE,
 			{'Statuses' : self._get_statuses}
 		)
+		self.session.addressbook.connect("contacts_changed", self.__on_contacts_changed)
 
 	@misc_utils.log_exception(_moduleLogger)
 	def GetPresences(self, contacts):
 		"""
 		@return {ContactHandle: (Status, Presence Type, Message)}
 		"""
-		personalMessage = u""
-		return dict(
-			(h, (presenceType, presence, personalMessage))
-			for (h, (presenceType, presence)) in self.get_presences(contacts).iteritems()
-		)
+		return self.__to_simple_presences(self.get_presences(contacts))
 
 	@misc_utils.log_exception(_moduleLogger)
 	def SetPresence(self, status, message):
@@ -126,6 +161,21 @@ class SimplePresenceMixin(tp.ConnectionInterfaceSimplePresence, BluewirePresence
 
 		self.set_presence(status)
 
+	@misc_utils.log_exception(_moduleLogger)
+	def __on_contacts_changed(self, addressbook, added, removed, changed):
+		# Includes probes finding devices gone or back and proximity shifts,
+		# so clients hear about them without polling
+		presences = self.get_contact_presences(itertools.chain(added, removed, changed))
+		if presences:
+			self.PresencesChanged(self.__to_simple_presences(presences))
+
+	def __to_simple_presences(self, presences):
+		personalMessage = u""
+		return dict(
+			(h, (presenceType, presence, personalMessage))
+			for (h, (presenceType, presence)) in presences.iteritems()
+		)
+
 	def _get_statuses(self):
 		"""
 		Property mapping presence statuses available to the corresponding presence types
@@ -20,6 +20,7 @@
 
 import dbus
 import dbus.service
+import logging
 import re
 import weakref
 
@@ -44,6 +45,8 @@ from properties import DBusProperties
 
 from telepathy._generated.Connection import Connection as _Connection
 
+_moduleLogger = logging.getLogger(__name__)
+
 _BAD = re.compile(r'(?:^[0-9])|(?:[^A-Za-z0-9])')
 
 def _escape_as_identifier(name):
@@ -99,7 +102,14 @@ class Connection(_Connection, DBusProperties):
         self._status = CONNECTION_STATUS_DISCONNECTED
 
         self._handles = weakref.WeakValueDictionary()
+        # (type, name) -> handle, maintained alongside _handles by add_handle
+        # so name lookups don't have to scan every handle
+        self._handles_by_name = weakref.WeakValueDictionary()
+        # Ids are never reused, a client may still have an id it saw in a
+        # signal without holding it and must not have it silently turn into
+        # another contact.  The handles themselves are freed once unused.
         self._next_handle_id = 1
+        # sender -> {(type, handle): hold count}
         self._client_handles = {}
 
         self._channels = set()
@@ -148,11 +158,30 @@ class Connection(_Connection, DBusProperties):
 
     def check_handle(self, handle_type, handle):
         if (handle_type, handle) not in self._handles:
-            print "Connection.check_handle", handle, handle_type, self._handles.keys()
-            print str(list( [ self._handles[x] for x in self._handles.keys() ] ) )
+            _moduleLogger.warning('Invalid handle %r of type %r (%d handles live)',
+                handle, handle_type, len(self._handles))
             raise InvalidHandle('handle number %d not valid for type %d' %
                 (handle, handle_type))
 
+    def check_handles(self, handle_type, handles):
+        """
+        Validate an array of handle ids in one pass, resolving each distinct
+        id only once.
+
+        Returns the handle objects in the same order as handles.
+        """
+        handle_type = int(handle_type)
+        resolved = dict((id, self._handles.get((handle_type, id)))
+            for id in set(int(handle) for handle in handles))
+        invalid = sorted(id for (id, handle) in resolved.iteritems()
+            if handle is None)
+        if invalid:
+            _moduleLogger.warning('Invalid handles %r of type %r (%d handles live)',
+                invalid, handle_type, len(self._handles))
+            raise InvalidHandle('handle numbers %s not valid for type %d' %
+                (', '.join(str(id) for id in invalid), handle_type))
+        return [resolved[int(handle)] for handle in handles]
+
     def check_handle_type(self, type):
         if (type <= HANDLE_TYPE_NONE or type > LAST_HANDLE_TYPE):
             raise InvalidArgument('handle type %s not known' % type)
@@ -162,11 +191,36 @@ class Connection(_Connection, DBusProperties):
         self._next_handle_id += 1
         return id
 
+    def add_handle(self, handle):
+        """
+        Register a handle so it can be looked up by either id or name.
+        """
+        handle_type = handle.get_type()
+        key = (handle_type, handle.get_id())
+        self._handles[key] = handle
+        self._handles_by_name[handle_type, handle.get_name()] = handle
+
     def add_client_handle(self, handle, sender):
-        if sender in self._client_handles:
-            self._client_handles[sender].add((handle.get_type(), handle))
-        else:
-            self._client_handles[sender] = set([(handle.get_type(), handle)])
+        held = self._client_handles.setdefault(sender, {})
+        key = (handle.get_type(), handle)
+        held[key] = held.get(key, 0) + 1
+
+    def get_handle_stats(self):
+        """
+        Returns a dict of counters describing handle usage.
+        """
+        held = set()
+        holds = 0
+        for client_handles in self._client_handles.itervalues():
+            held.update(client_handles.iterkeys())
+            holds += sum(client_handles.itervalues())
+        return {
+            'live': len(self._handles),
+            'held': len(held),
+            'holds': holds,
+            'clients': len(self._client_handles),
+            'allocated': self._next_handle_id - 1,
+        }
 
     def get_handle_by_id(self, handle_type, handle_id):
         # Strip off dbus stuff so we can be consistent
@@ -177,16 +231,12 @@ class Connection(_Connection, DBusProperties):
 
     def get_handle_by_name(self, handle_type, handle_name):
         self.check_handle_type(handle_type)
-        handle = None
 
-        for candidate in self._handles.itervalues():
-            if candidate.get_name() == handle_name:
-                handle = candidate
-                break
-        else:
+        handle = self._handles_by_name.get((handle_type, handle_name))
+        if handle is None:
             id = self.get_handle_id()
             handle = Handle(id, handle_type, handle_name)
-            self._handles[handle_type, id] = handle
+            self.add_handle(handle)
 
         return handle
 
@@ -194,7 +244,7 @@ class Connection(_Connection, DBusProperties):
         # when name and old_owner are the same, and new_owner is
         # blank, it is the client itself releasing its name... aka exiting
         if (name == old_owner and new_owner == "" and name in self._client_handles):
-            print "deleting handles for", name
+            _moduleLogger.debug('Dropping handles held by %s', name)
             del self._client_handles[name]
 
     def set_self_handle(self, handle):
@@ -251,14 +301,8 @@ class Connection(_Connection, DBusProperties):
         self.check_connected()
         self.check_handle_type(handle_type)
 
-        for handle in handles:
-            self.check_handle(handle_type, handle)
-
-        ret = []
-        for handle in handles:
-            ret.append(self._handles[handle_type, handle].get_name())
-
-        return ret
+        return [handle.get_name()
+            for handle in self.check_handles(handle_type, handles)]
 
     @dbus.service.method(CONN_INTERFACE, in_signature='uas', out_signature='au', sender_keyword='sender')
     def RequestHandles(self, handle_type, names, sender):
@@ -278,11 +322,7 @@ class Connection(_Connection, DBusProperties):
         self.check_connected()
         self.check_handle_type(handle_type)
 
-        for handle in handles:
-            self.check_handle(handle_type, handle)
-
-        for handle in handles:
-            hand = self._handles[handle_type, handle]
+        for hand in self.check_handles(handle_type, handles):
             self.add_client_handle(hand, sender)
 
     @dbus.service.method(CONN_INTERFACE, in_signature='uau', out_signature='', sender_keyword='sender')
@@ -290,18 +330,29 @@ class Connection(_Connection, DBusProperties):
         self.check_connected()
         self.check_handle_type(handle_type)
 
-        for handle in handles:
-            self.check_handle(handle_type, handle)
-            hand = self._handles[handle_type, handle]
-            if sender in self._client_handles:
-                if (handle_type, hand) not in self._client_handles[sender]:
-                    raise NotAvailable('client is not holding handle %s of type %s' % (handle, handle_type))
+        hands = self.check_handles(handle_type, handles)
+        if sender not in self._client_handles:
+            raise NotAvailable('client does not hold any handles')
+
+        held = self._client_handles[sender]
+        releasing = {}
+        for hand in hands:
+            key = (handle_type, hand)
+            releasing[key] = releasing.get(key, 0) + 1
+        not_held = [key for (key, count) in releasing.iteritems()
+            if held.get(key, 0) < count]
+        if not_held:
+            raise NotAvailable('client is not holding handles %s of type %s' %
+                (', '.join(str(hand.get_id()) for (_, hand) in not_held), handle_type))
+
+        for key, count in releasing.iteritems():
+            remaining = held[key] - count
+            if remaining:
+                held[key] = remaining
             else:
-                raise NotAvailable('client does not hold any handles')
-
-        for handle in handles:
-            hand = self._handles[handle_type, handle]
-            self._client_handles[sender].remove((handle_type, hand))
+                del held[key]
+        if not held:
+            del self._client_handles[sender]
 
     @dbus.service.method(CONN_INTERFACE, in_signature='', out_signature='u')
     def GetSelfHandle(self):
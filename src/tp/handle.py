@@ -18,6 +18,8 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 class Handle(object):
+    __slots__ = ('_id', '_type', '_name', '__weakref__')
+
     def __init__(self, id, handle_type, name):
         self._id = id
         self._type = handle_type
@@ -3,6 +3,9 @@
 from __future__ import with_statement
 
 import time
+import heapq
+import collections
+import itertools
 import functools
 import threading
 import Queue
@@ -10,7 +13,6 @@ import logging
 
 import gobject
 
-import algorithms
 import misc
 
 
@@ -103,6 +105,15 @@ class Timeout(object):
 		assert self.__timeoutId is None
 
 		assert len(kwds) == 1
+		if "milliseconds" in kwds:
+			timeoutInMilliseconds = kwds["milliseconds"]
+			assert 0 <= timeoutInMilliseconds
+			if timeoutInMilliseconds == 0:
+				self.__timeoutId = gobject.idle_add(self._on_once)
+			else:
+				self.__timeoutId = gobject.timeout_add(timeoutInMilliseconds, self._on_once)
+			return
+
 		timeoutInSeconds = kwds["seconds"]
 		assert 0 <= timeoutInSeconds
 		if timeoutInSeconds == 0:
@@ -131,33 +142,88 @@ class Timeout(object):
 		return False
 
 
-_QUEUE_EMPTY = object()
-
-
 class AsyncPool(object):
+	"""
+	Runs blocking calls on worker threads, handing the results back to the
+	main loop.
 
-	def __init__(self):
-		self.__workQueue = Queue.Queue()
-		self.__thread = threading.Thread(
-			name = type(self).__name__,
-			target = self.__consume_queue,
-		)
+	Tasks are picked up in priority order, FIFO within a priority, except
+	that tasks sharing a key are never run at the same time (e.g. one inquiry
+	per adapter or one operation per remote address).
+	"""
+
+	PRIORITY_INTERACTIVE = 0
+	PRIORITY_BACKGROUND = 1
+
+	# Bounds on how much callback work is done per main loop iteration
+	MAX_CALLBACKS_PER_DRAIN = 16
+	MAX_DRAIN_SECONDS = 0.01
+
+	def __init__(self, workerCount = 1, maxQueueDepth = None):
+		"""
+		@param maxQueueDepth Past this many queued tasks, new background tasks
+			are refused with Queue.Full
+		"""
+		assert 0 < workerCount
+		self.__maxQueueDepth = maxQueueDepth
+		self.__condition = threading.Condition()
+		self.__pending = []
+		self.__counter = itertools.count()
+		self.__queueDepth = 0
+		self.__busyKeys = set()
+		self.__blocked = {}
+
+		# Completions are handed back through a single idle source, rather
+		# than one per task, to cut down on main loop wakeups
+		self.__completedLock = threading.Lock()
+		self.__completed = collections.deque()
+		self.__isDrainScheduled = False
+
+		self.__threads = [
+			threading.Thread(
+				name = "%s-%d" % (type(self).__name__, i),
+				target = self.__consume_queue,
+			)
+			for i in xrange(workerCount)
+		]
 		self.__isRunning = True
 
 	def start(self):
-		self.__thread.start()
+		for thread in self.__threads:
+			thread.start()
 
 	def stop(self):
-		self.__isRunning = False
-		for _ in algorithms.itr_available(self.__workQueue):
-			pass # eat up queue to cut down dumb work
-		self.__workQueue.put(_QUEUE_EMPTY)
-
-	def add_task(self, func, args, kwds, on_success, on_error):
-		task = func, args, kwds, on_success, on_error
-		self.__workQueue.put(task)
+		with self.__condition:
+			self.__isRunning = False
+			# eat up queue to cut down dumb work
+			del self.__pending[:]
+			self.__blocked.clear()
+			self.__queueDepth = 0
+			self.__condition.notifyAll()
+
+	def add_task(
+		self, func, args, kwds, on_success, on_error,
+		priority = PRIORITY_INTERACTIVE, key = None, isContinuation = False,
+	):
+		"""
+		@param key Tasks with the same key (other than None) are serialized
+		@param isContinuation Follow-up steps of work already accepted are
+			exempt from the queue depth limit
+		@raises Queue.Full When the queue is at capacity for this task
+		"""
+		task = func, args, kwds, on_success, on_error, key
+		with self.__condition:
+			if (
+				self.__maxQueueDepth is not None and
+				priority != self.PRIORITY_INTERACTIVE and
+				not isContinuation and
+				self.__maxQueueDepth <= self.__queueDepth
+			):
+				raise Queue.Full("%d tasks already queued" % self.__queueDepth)
+			heapq.heappush(self.__pending, (priority, self.__counter.next(), task))
+			self.__queueDepth += 1
+			self.__condition.notify()
 
-	@misc.log_exception(_moduleLogger)
 	def __trampoline_callback(self, on_success, on_error, isError, result):
 		if not self.__isRunning:
 			if isError:
@@ -170,15 +236,69 @@ class AsyncPool(object):
 		except Exception:
 			_moduleLogger.exception("Callback errored")
 			pass
-		return False
+
+	def __complete_task(self, on_success, on_error, isError, result):
+		with self.__completedLock:
+			self.__completed.append((on_success, on_error, isError, result))
+			if self.__isDrainScheduled:
+				return
+			self.__isDrainScheduled = True
+		gobject.idle_add(self.__drain_completed)
+
+	@misc.log_exception(_moduleLogger)
+	def __drain_completed(self):
+		deadline = time.time() + self.MAX_DRAIN_SECONDS
+		for _ in xrange(self.MAX_CALLBACKS_PER_DRAIN):
+			with self.__completedLock:
+				if not self.__completed:
+					self.__isDrainScheduled = False
+					return False
+				completion = self.__completed.popleft()
+			self.__trampoline_callback(*completion)
+			if deadline < time.time():
+				break
+
+		with self.__completedLock:
+			if not self.__completed:
+				self.__isDrainScheduled = False
+				return False
+		# More left over, let the main loop breathe and come back for them
+		return True
+
+	def __next_task(self):
+		with self.__condition:
+			while self.__isRunning:
+				while self.__pending:
+					entry = heapq.heappop(self.__pending)
+					key = entry[2][-1]
+					if key is not None and key in self.__busyKeys:
+						# Parked until the task holding the key finishes
+						self.__blocked.setdefault(key, []).append(entry)
+						continue
+					if key is not None:
+						self.__busyKeys.add(key)
+					self.__queueDepth -= 1
+					return entry[2]
+				self.__condition.wait()
+			return None
+
+	def __release_key(self, key):
+		with self.__condition:
+			self.__busyKeys.discard(key)
+			blocked = self.__blocked.get(key, None)
+			if blocked:
+				heapq.heappush(self.__pending, blocked.pop(0))
+				if not blocked:
+					del self.__blocked[key]
+				self.__condition.notify()
 
 	@misc.log_exception(_moduleLogger)
 	def __consume_queue(self):
 		while True:
-			task = self.__workQueue.get()
-			if task is _QUEUE_EMPTY:
+			task = self.__next_task()
+			if task is None:
 				break
-			func, args, kwds, on_success, on_error = task
+			func, args, kwds, on_success, on_error, key = task
 
 			try:
 				result = func(*args, **kwds)
@@ -187,61 +307,205 @@ class AsyncPool(object):
 				_moduleLogger.error("Error, passing it back to the main thread")
 				result = e
 				isError = True
-			self.__workQueue.task_done()
+			if key is not None:
+				self.__release_key(key)
+
+			self.__complete_task(on_success, on_error, isError, result)
+
+
+class CancelledError(Exception):
+	pass
+
+
+class StepTimeoutError(Exception):
+	pass
+
+
+class CancellationToken(object):
+	"""
+	Shared between whoever wants work stopped and whoever is doing it.
+	Cancelling calls everything that registered with the token, which is how
+	cancellation reaches blocking calls (e.g. closing a socket out from under
+	a connect).
+	"""
 
-			gobject.idle_add(self.__trampoline_callback, on_success, on_error, isError, result)
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._isCancelled = False
+		self._callbacks = []
+
+	@property
+	def isCancelled(self):
+		return self._isCancelled
+
+	def cancel(self):
+		with self._lock:
+			if self._isCancelled:
+				return
+			self._isCancelled = True
+			callbacks = self._callbacks
+			self._callbacks = []
+		for callback in callbacks:
+			try:
+				callback()
+			except Exception:
+				_moduleLogger.exception("Cancellation callback errored")
+
+	def register(self, callback):
+		"""
+		Safe from any thread, if already cancelled, callback is called
+		immediately
+		"""
+		with self._lock:
+			if not self._isCancelled:
+				self._callbacks.append(callback)
+				return
+		callback()
+
+	def unregister(self, callback):
+		with self._lock:
+			try:
+				self._callbacks.remove(callback)
+			except ValueError:
+				pass
+
+	def check(self):
+		if self._isCancelled:
+			raise CancelledError("Cancelled")
 
 
 class AsyncLinearExecution(object):
+	"""
+	Runs a generator-function as a series of steps on an AsyncPool.  Each
+	step yielded is (func, args, kwds) or (func, args, kwds, timeoutInSeconds)
+	with the result (or exception) being sent back into the generator.
 
-	def __init__(self, pool, func):
+	On cancellation or a step timing out, the generator has CancelledError or
+	StepTimeoutError thrown into it and the late result of the abandoned step
+	is dropped.  No further steps are run once cancelled.
+	"""
+
+	def __init__(
+		self, pool, func,
+		priority = AsyncPool.PRIORITY_INTERACTIVE, key = None,
+		cancellation = None, stepTimeout = None,
+	):
 		self._pool = pool
 		self._func = func
+		self._priority = priority
+		self._key = key
+		self._cancellation = cancellation if cancellation is not None else CancellationToken()
+		self._stepTimeout = stepTimeout
 		self._run = None
+		self._isFinished = False
+		self._stepId = 0
+		self._stepTimer = Timeout(self._on_step_timeout)
+
+	@property
+	def cancellation(self):
+		return self._cancellation
+
+	def cancel(self):
+		self._cancellation.cancel()
 
 	def start(self, *args, **kwds):
 		assert self._run is None
 		self._run = self._func(*args, **kwds)
-		trampoline, args, kwds = self._run.send(None) # priming the function
-		self._pool.add_task(
-			trampoline,
-			args,
-			kwds,
-			self.on_success,
-			self.on_error,
-		)
+		step = self._run.send(None) # priming the function
+		if self._cancellation.isCancelled:
+			# A shared token cancelled before we started, unwind the generator
+			# the same as if its first step had been cancelled
+			self._abandon_step(CancelledError("Cancelled"))
+			return
+		self._add_step(step, isContinuation = False)
+		# Only once the first step is queued, registering calls us straight
+		# away if the token was cancelled in the meantime
+		self._cancellation.register(self._on_cancelled)
 
 	@misc.log_exception(_moduleLogger)
 	def on_success(self, result):
 		_moduleLogger.debug("Processing success for: %r", self._func)
-		try:
-			trampoline, args, kwds = self._run.send(result)
-		except StopIteration, e:
-			pass
-		else:
-			self._pool.add_task(
-				trampoline,
-				args,
-				kwds,
-				self.on_success,
-				self.on_error,
-			)
+		self._resume(self._run.send, result)
 
 	@misc.log_exception(_moduleLogger)
 	def on_error(self, error):
 		_moduleLogger.debug("Processing error for: %r", self._func)
+		self._resume(self._run.throw, error)
+
+	def _resume(self, resumer, value):
+		self._stepTimer.cancel()
 		try:
-			trampoline, args, kwds = self._run.throw(error)
+			step = resumer(value)
 		except StopIteration, e:
-			pass
+			self._finish()
+		except CancelledError, e:
+			# The generator didn't care to clean anything up
+			self._finish()
+		except:
+			self._finish()
+			raise
 		else:
-			self._pool.add_task(
-				trampoline,
-				args,
-				kwds,
-				self.on_success,
-				self.on_error,
-			)
+			self._add_step(step, isContinuation = True)
+
+	def _add_step(self, step, isContinuation):
+		if self._cancellation.isCancelled:
+			_moduleLogger.debug("Not running further steps of cancelled %r", self._func)
+			self._run.close()
+			self._finish()
+			return
+
+		trampoline, args, kwds = step[0:3]
+		timeout = step[3] if 3 < len(step) else self._stepTimeout
+
+		self._stepId += 1
+		stepId = self._stepId
+		self._pool.add_task(
+			trampoline,
+			args,
+			kwds,
+			functools.partial(self._on_step_success, stepId),
+			functools.partial(self._on_step_error, stepId),
+			priority = self._priority,
+			key = self._key,
+			isContinuation = isContinuation,
+		)
+		if timeout is not None:
+			self._stepTimer.start(seconds=timeout)
+
+	def _finish(self):
+		self._isFinished = True
+		self._stepTimer.cancel()
+		self._cancellation.unregister(self._on_cancelled)
+
+	def _is_current_step(self, stepId):
+		if stepId != self._stepId or self._isFinished:
+			_moduleLogger.debug("Dropping result of abandoned step for: %r", self._func)
+			return False
+		return True
+
+	def _on_step_success(self, stepId, result):
+		if self._is_current_step(stepId):
+			self.on_success(result)
+
+	def _on_step_error(self, stepId, error):
+		if self._is_current_step(stepId):
+			self.on_error(error)
+
+	def _abandon_step(self, error):
+		if self._isFinished:
+			return
+		self._stepId += 1
+		self.on_error(error)
+
+	@misc.log_exception(_moduleLogger)
+	def _on_step_timeout(self):
+		_moduleLogger.info("Step timed out for: %r", self._func)
+		self._abandon_step(StepTimeoutError("Step timed out"))
+
+	@misc.log_exception(_moduleLogger)
+	def _on_cancelled(self):
+		_moduleLogger.info("Cancelling: %r", self._func)
+		self._abandon_step(CancelledError("Cancelled"))
 
 
 def throttled(minDelay, queue):
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+from __future__ import with_statement
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import time
+import unittest
+
+import gobject
+
+import util.go_utils as gobject_utils
+import protocol.simulated_backend as simulated_backend
+import protocol.addressbook as addressbook
+import protocol.name_resolver as name_resolver
+import protocol.device_cache as device_cache
+import protocol.probe_scheduler as probe_scheduler
+
+
+gobject.threads_init()
+
+
+def _iterate_until(condition, timeout = 5):
+	"""
+	Run the main loop until condition() holds or timeout seconds pass
+	"""
+	context = gobject.main_context_default()
+	deadline = time.time() + timeout
+	while not condition():
+		if deadline < time.time():
+			raise AssertionError("Timed out waiting on the main loop")
+		if not context.iteration(False):
+			time.sleep(0.005)
+
+
+class SimulatedAddressbookTest(unittest.TestCase):
+
+	def setUp(self):
+		self.backend = simulated_backend.SimulatedBackend(
+			deviceCount = 4,
+			inquiryLatency = 0.1,
+			nameDelay = 0.01,
+		)
+		self.pool = gobject_utils.AsyncPool()
+		self.nameResolver = name_resolver.NameResolver(self.backend)
+		self.addressbook = addressbook.Addressbook(
+			self.backend, self.pool, self.nameResolver, device_cache.DeviceCache(None),
+		)
+		self.changes = []
+		self.addressbook.connect("contacts_changed", self._on_contacts_changed)
+		self.pool.start()
+		self.nameResolver.start()
+
+	def tearDown(self):
+		self.nameResolver.stop()
+		self.pool.stop()
+
+	def _on_contacts_changed(self, addressbook, added, removed, changed):
+		self.changes.append((added, removed, changed))
+
+	def test_update_finds_every_device(self):
+		results = []
+		self.assert_(self.addressbook.update(force = True, on_success = results.append, on_error = results.append))
+		_iterate_until(lambda: results)
+
+		expected = set(device.address for device in simulated_backend.create_devices(4))
+		self.assertEqual(set(self.addressbook.get_addresses()), expected)
+		self.assertEqual(results[0]["total"], 4)
+		streamedAdded = set()
+		for added, removed, changed in self.changes:
+			streamedAdded.update(added)
+		self.assertEqual(streamedAdded, expected)
+
+	def test_names_are_resolved(self):
+		results = []
+		self.addressbook.update(force = True, on_success = results.append)
+		_iterate_until(lambda: results)
+		address = iter(self.addressbook.get_addresses()).next()
+		_iterate_until(lambda: self.addressbook.get_contact_name(address) != address)
+
+	def test_joining_an_update(self):
+		results = []
+		self.assert_(self.addressbook.update(force = True, on_success = results.append))
+		self.failIf(self.addressbook.update(force = True, on_success = results.append))
+		_iterate_until(lambda: len(results) == 2)
+		self.assert_(results[0] is results[1])
+
+
+class _MissingBackend(simulated_backend.SimulatedBackend):
+	"""
+	An inquiry that misses every device it was told to
+	"""
+
+	def __init__(self, *args, **kwds):
+		simulated_backend.SimulatedBackend.__init__(self, *args, **kwds)
+		self.missing = set()
+
+	def get_contacts(self, streaming=False, cancellation=None):
+		contacts = simulated_backend.SimulatedBackend.get_contacts(self, False, cancellation)
+		return [contact for contact in contacts if contact[0] not in self.missing]
+
+
+class ProbedAddressbookTest(unittest.TestCase):
+
+	def setUp(self):
+		self.backend = _MissingBackend(deviceCount = 2, inquiryLatency = 0.01, nameDelay = 0.01)
+		self.pool = gobject_utils.AsyncPool()
+		self.prober = probe_scheduler.ProbeScheduler(self.backend, self.pool)
+		self.addressbook = addressbook.Addressbook(
+			self.backend, self.pool, name_resolver.NameResolver(self.backend),
+			device_cache.DeviceCache(None),
+			absenceThreshold = 1,
+			prober = self.prober,
+		)
+		self.pool.start()
+
+	def tearDown(self):
+		self.prober.stop()
+		self.pool.stop()
+
+	def _update(self):
+		results = []
+		self.addressbook.update(force = True, streaming = False, on_success = results.append)
+		_iterate_until(lambda: results)
+
+	def test_answered_probe_outlasts_a_missed_inquiry(self):
+		self._update()
+		first, second = sorted(self.addressbook.get_addresses())
+		self.backend.missing.update((first, second))
+		self.prober.emit("probed", first, "Answered")
+		self._update()
+		self.assertEqual(list(self.addressbook.get_addresses()), [first])
+
+		# Only until the next update, without another answer it goes too
+		self._update()
+		self.assertEqual(list(self.addressbook.get_addresses()), [])
+
+
+if __name__ == "__main__":
+	unittest.main()
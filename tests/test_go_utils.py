@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+
+from __future__ import with_statement
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import time
+import threading
+import unittest
+import Queue
+
+import gobject
+
+import util.go_utils as gobject_utils
+
+
+gobject.threads_init()
+
+
+def _iterate_until(condition, timeout = 5):
+	"""
+	Run the main loop until condition() holds or timeout seconds pass
+	"""
+	context = gobject.main_context_default()
+	deadline = time.time() + timeout
+	while not condition():
+		if deadline < time.time():
+			raise AssertionError("Timed out waiting on the main loop")
+		if not context.iteration(False):
+			time.sleep(0.005)
+
+
+def _iterate_for(seconds):
+	context = gobject.main_context_default()
+	deadline = time.time() + seconds
+	while time.time() < deadline:
+		if not context.iteration(False):
+			time.sleep(0.005)
+
+
+class _ConcurrencyCounter(object):
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._running = 0
+		self.maxRunning = 0
+
+	def run(self, duration, result = None):
+		with self._lock:
+			self._running += 1
+			self.maxRunning = max(self.maxRunning, self._running)
+		time.sleep(duration)
+		with self._lock:
+			self._running -= 1
+		return result
+
+
+class AsyncPoolTest(unittest.TestCase):
+
+	def setUp(self):
+		self.pool = None
+		self.results = []
+		self.errors = []
+
+	def tearDown(self):
+		if self.pool is not None:
+			self.pool.stop()
+
+	def _start_pool(self, *args, **kwds):
+		self.pool = gobject_utils.AsyncPool(*args, **kwds)
+		self.pool.start()
+		return self.pool
+
+	def _add_task(self, func, *args, **kwds):
+		self.pool.add_task(func, args, {}, self.results.append, self.errors.append, **kwds)
+
+	def test_results_reach_the_main_loop(self):
+		self._start_pool()
+		self._add_task(lambda x: x * 2, 21)
+		self._add_task(lambda: 1 / 0)
+		_iterate_until(lambda: len(self.results) + len(self.errors) == 2)
+		self.assertEqual(self.results, [42])
+		self.assertEqual(len(self.errors), 1)
+		self.assert_(isinstance(self.errors[0], ZeroDivisionError))
+
+	def test_priority_order(self):
+		self._start_pool(workerCount = 1)
+		blocker = threading.Event()
+		self._add_task(blocker.wait)
+		self._add_task(lambda: "background", priority = gobject_utils.AsyncPool.PRIORITY_BACKGROUND)
+		self._add_task(lambda: "interactive")
+		blocker.set()
+		_iterate_until(lambda: len(self.results) == 3)
+		self.assertEqual(self.results[1:], ["interactive", "background"])
+
+	def test_same_key_is_serialized(self):
+		self._start_pool(workerCount = 3)
+		counter = _ConcurrencyCounter()
+		for i in xrange(3):
+			self._add_task(counter.run, 0.05, i, key = "device")
+		_iterate_until(lambda: len(self.results) == 3)
+		self.assertEqual(counter.maxRunning, 1)
+		self.assertEqual(self.results, [0, 1, 2])
+
+	def test_different_keys_run_side_by_side(self):
+		self._start_pool(workerCount = 2)
+		counter = _ConcurrencyCounter()
+		self._add_task(counter.run, 0.2, key = "first")
+		self._add_task(counter.run, 0.2, key = "second")
+		_iterate_until(lambda: len(self.results) == 2)
+		self.assertEqual(counter.maxRunning, 2)
+
+	def test_key_waiter_does_not_block_other_tasks(self):
+		self._start_pool(workerCount = 2)
+		blocker = threading.Event()
+		self._add_task(blocker.wait, key = "inquiry")
+		self._add_task(lambda: "queued behind", key = "inquiry")
+		self._add_task(lambda: "unrelated")
+		_iterate_until(lambda: len(self.results) == 1)
+		self.assertEqual(self.results, ["unrelated"])
+		blocker.set()
+		_iterate_until(lambda: len(self.results) == 3)
+		self.assert_("queued behind" in self.results[1:])
+
+	def test_back_pressure(self):
+		# Not started so nothing leaves the queue
+		self.pool = gobject_utils.AsyncPool(maxQueueDepth = 1)
+		background = gobject_utils.AsyncPool.PRIORITY_BACKGROUND
+		self._add_task(lambda: None, priority = background)
+		self.assertRaises(Queue.Full, self._add_task, lambda: None, priority = background)
+		# Interactive work and follow up steps are never refused
+		self._add_task(lambda: None)
+		self._add_task(lambda: None, priority = background, isContinuation = True)
+
+	def test_drain_is_bounded(self):
+		class SmallDrainPool(gobject_utils.AsyncPool):
+			MAX_CALLBACKS_PER_DRAIN = 2
+
+		self.pool = SmallDrainPool()
+		ran = []
+		for i in xrange(5):
+			self._add_task(ran.append, i)
+		self.pool.start()
+		deadline = time.time() + 5
+		while len(ran) < 5 and time.time() < deadline:
+			time.sleep(0.01)
+		# Give the last completion time to be handed off
+		time.sleep(0.05)
+
+		context = gobject.main_context_default()
+		context.iteration(False)
+		self.assertEqual(len(self.results), 2)
+		_iterate_until(lambda: len(self.results) == 5)
+
+	def test_stop_masks_callbacks(self):
+		self._start_pool(workerCount = 1)
+		started = threading.Event()
+		blocker = threading.Event()
+		self._add_task(lambda: (started.set(), blocker.wait()))
+		self._add_task(lambda: "never run")
+		started.wait(5)
+		self.pool.stop()
+		blocker.set()
+		_iterate_until(lambda: self.errors)
+		self.assertEqual(self.results, [])
+		self.assert_(isinstance(self.errors[0], StopIteration))
+
+
+class AsyncLinearExecutionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.pool = gobject_utils.AsyncPool(workerCount = 2)
+		self.pool.start()
+		self.events = []
+
+	def tearDown(self):
+		self.pool.stop()
+
+	def test_steps_run_in_order(self):
+		def steps():
+			first = yield (lambda x: x + 1, (1, ), {})
+			self.events.append(first)
+			try:
+				yield (lambda: 1 / 0, (), {})
+			except ZeroDivisionError:
+				self.events.append("error")
+			self.events.append("done")
+
+		gobject_utils.AsyncLinearExecution(self.pool, steps).start()
+		_iterate_until(lambda: "done" in self.events)
+		self.assertEqual(self.events, [2, "error", "done"])
+
+	def test_cancel_throws_and_drops_late_result(self):
+		blocker = threading.Event()
+
+		def steps():
+			try:
+				result = yield (blocker.wait, (), {})
+				self.events.append(("result", result))
+			except gobject_utils.CancelledError:
+				self.events.append("cancelled")
+
+		le = gobject_utils.AsyncLinearExecution(self.pool, steps)
+		le.start()
+		le.cancel()
+		self.assertEqual(self.events, ["cancelled"])
+		self.assert_(le.cancellation.isCancelled)
+
+		blocker.set()
+		_iterate_for(0.2)
+		self.assertEqual(self.events, ["cancelled"])
+
+	def test_no_steps_after_cancel(self):
+		blocker = threading.Event()
+		ran = []
+
+		def steps():
+			try:
+				yield (blocker.wait, (), {})
+			except gobject_utils.CancelledError:
+				self.events.append("cancelled")
+			yield (ran.append, ("cleanup step", ), {})
+			self.events.append("resumed")
+
+		le = gobject_utils.AsyncLinearExecution(self.pool, steps)
+		le.start()
+		le.cancel()
+		blocker.set()
+		_iterate_for(0.2)
+		self.assertEqual(self.events, ["cancelled"])
+		self.assertEqual(ran, [])
+
+	def test_shared_cancellation_token(self):
+		token = gobject_utils.CancellationToken()
+		blocker = threading.Event()
+
+		def steps(name):
+			try:
+				yield (blocker.wait, (), {})
+			except gobject_utils.CancelledError:
+				self.events.append(name)
+
+		for name in ("first", "second"):
+			le = gobject_utils.AsyncLinearExecution(self.pool, steps, cancellation = token)
+			le.start(name)
+		token.cancel()
+		blocker.set()
+		self.assertEqual(sorted(self.events), ["first", "second"])
+
+	def test_already_cancelled_token(self):
+		token = gobject_utils.CancellationToken()
+		token.cancel()
+		ran = []
+
+		def steps():
+			try:
+				yield (ran.append, ("first step", ), {})
+			except gobject_utils.CancelledError:
+				self.events.append("cancelled")
+
+		le = gobject_utils.AsyncLinearExecution(self.pool, steps, cancellation = token)
+		le.start()
+		_iterate_for(0.2)
+		self.assertEqual(self.events, ["cancelled"])
+		self.assertEqual(ran, [])
+
+	def test_step_timeout(self):
+		blocker = threading.Event()
+
+		def steps():
+			try:
+				result = yield (blocker.wait, (), {}, 1)
+				self.events.append(("result", result))
+			except gobject_utils.StepTimeoutError:
+				self.events.append("timed out")
+
+		gobject_utils.AsyncLinearExecution(self.pool, steps).start()
+		_iterate_until(lambda: self.events, timeout = 5)
+		self.assertEqual(self.events, ["timed out"])
+
+		blocker.set()
+		_iterate_for(0.2)
+		self.assertEqual(self.events, ["timed out"])
+
+	def test_default_step_timeout(self):
+		blocker = threading.Event()
+
+		def steps():
+			try:
+				yield (blocker.wait, (), {})
+			except gobject_utils.StepTimeoutError:
+				self.events.append("timed out")
+
+		gobject_utils.AsyncLinearExecution(self.pool, steps, stepTimeout = 1).start()
+		try:
+			_iterate_until(lambda: self.events, timeout = 5)
+		finally:
+			blocker.set()
+		self.assertEqual(self.events, ["timed out"])
+
+
+class CancellationTokenTest(unittest.TestCase):
+
+	def test_callbacks(self):
+		token = gobject_utils.CancellationToken()
+		called = []
+		token.register(lambda: called.append("registered"))
+		unregistered = lambda: called.append("unregistered")
+		token.register(unregistered)
+		token.unregister(unregistered)
+		token.cancel()
+		token.cancel()
+		self.assertEqual(called, ["registered"])
+		self.assertRaises(gobject_utils.CancelledError, token.check)
+
+		# Registering late still hears about it
+		token.register(lambda: called.append("late"))
+		self.assertEqual(called, ["registered", "late"])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+from __future__ import with_statement
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import time
+import threading
+import unittest
+
+import gobject
+
+import protocol.name_resolver as name_resolver
+
+
+gobject.threads_init()
+
+
+def _iterate_until(condition, timeout = 5):
+	"""
+	Run the main loop until condition() holds or timeout seconds pass
+	"""
+	context = gobject.main_context_default()
+	deadline = time.time() + timeout
+	while not condition():
+		if deadline < time.time():
+			raise AssertionError("Timed out waiting on the main loop")
+		if not context.iteration(False):
+			time.sleep(0.005)
+
+
+def _iterate_for(seconds):
+	context = gobject.main_context_default()
+	deadline = time.time() + seconds
+	while time.time() < deadline:
+		if not context.iteration(False):
+			time.sleep(0.005)
+
+
+class _StuckBackend(object):
+	"""
+	Lookups of "stuck" block until released
+	"""
+
+	def __init__(self):
+		self.release = threading.Event()
+		self.lookups = []
+
+	def lookup_name(self, address, timeout):
+		self.lookups.append((address, threading.currentThread()))
+		if address == "stuck":
+			self.release.wait()
+		return "Name of %s" % (address, )
+
+
+class NameResolverTest(unittest.TestCase):
+
+	def setUp(self):
+		self.backend = _StuckBackend()
+		self.resolver = name_resolver.NameResolver(self.backend)
+		self.resolved = []
+		self.resolver.connect("name_resolved", lambda resolver, address, name: self.resolved.append(address))
+
+	def tearDown(self):
+		self.backend.release.set()
+		self.resolver.stop()
+
+	def test_restart_while_a_lookup_is_stuck(self):
+		self.resolver.start()
+		self.resolver.request("stuck")
+		_iterate_until(lambda: self.backend.lookups)
+		self.resolver.stop()
+
+		self.resolver.start()
+		for address in ("first", "second"):
+			self.resolver.request(address)
+		_iterate_until(lambda: len(self.resolved) == 2)
+		self.assertEqual(self.resolved, ["first", "second"])
+
+		# Only the new run's thread took work after the restart
+		stuckThread = self.backend.lookups[0][1]
+		self.failIf(any(thread is stuckThread for (_, thread) in self.backend.lookups[1:]))
+
+		# And the old one's late answer is dropped
+		self.backend.release.set()
+		_iterate_for(0.2)
+		self.assertEqual(self.resolved, ["first", "second"])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+from __future__ import with_statement
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import time
+import threading
+import unittest
+
+import gobject
+
+import util.go_utils as gobject_utils
+import protocol.probe_scheduler as probe_scheduler
+
+
+gobject.threads_init()
+
+
+def _iterate_until(condition, timeout = 5):
+	"""
+	Run the main loop until condition() holds or timeout seconds pass
+	"""
+	context = gobject.main_context_default()
+	deadline = time.time() + timeout
+	while not condition():
+		if deadline < time.time():
+			raise AssertionError("Timed out waiting on the main loop")
+		if not context.iteration(False):
+			time.sleep(0.005)
+
+
+class _BlockingBackend(object):
+
+	def __init__(self):
+		self.release = threading.Event()
+		self.started = []
+
+	def lookup_name(self, address, timeout):
+		self.started.append(address)
+		self.release.wait()
+		return "Name"
+
+
+class ProbeSchedulerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.backend = _BlockingBackend()
+		self.pool = gobject_utils.AsyncPool()
+		self.prober = probe_scheduler.ProbeScheduler(self.backend, self.pool, interval = 1)
+		self.probed = []
+		self.prober.connect("probed", lambda prober, address, name: self.probed.append((address, name)))
+		self.pool.start()
+		self.prober.start()
+
+	def tearDown(self):
+		self.backend.release.set()
+		self.prober.stop()
+		self.pool.stop()
+
+	def test_readding_drops_the_stale_probe(self):
+		self.prober.add("device")
+		_iterate_until(lambda: self.backend.started)
+		self.prober.remove("device")
+		self.prober.add("device")
+		timers = dict(self.prober._timers)
+
+		self.backend.release.set()
+		_iterate_until(lambda: not self.prober._inFlight)
+		# The re-added device keeps just the one timer add() gave it
+		self.assertEqual(self.prober._timers, timers)
+		self.assertEqual(self.probed, [])
+
+		_iterate_until(lambda: self.probed)
+		self.assertEqual(self.probed, [("device", "Name")])
+
+
+if __name__ == "__main__":
+	unittest.main()